@@ -1,8 +1,45 @@
 import streamlit as st
+import cache
+
+
+@st.cache_resource
+def streamlit_cache_backend():
+    return cache.StreamlitBackend()
+
+
+# One backend instance for the server's lifetime, so cached loaders are wrapped once rather than every rerun.
+cache.set_backend(streamlit_cache_backend())
+
+import threading
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from funcs import DataLoader
 from session import SessionManager, FormInputs, AppDisplay
+from watcher import RawDataWatcher
 
 st.set_page_config(layout="wide")
 
+
+@st.cache_resource
+def start_raw_data_watcher():
+    return RawDataWatcher().start()
+
+
+start_raw_data_watcher()
+
+
+@st.cache_resource
+def warm_pe_tables():
+    """
+    Loads the PE tables once per server, handing the loader threads this script's context
+    so their cache reads don't warn about a missing ScriptRunContext.
+    """
+    ctx = get_script_run_ctx()
+    DataLoader.preload_pe_tables(initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx))
+    return DataLoader.pe_load_timings()
+
+
+pe_load_timings = warm_pe_tables()
+
 session_manager = SessionManager()
 form_inputs = FormInputs()
 display = AppDisplay()
@@ -11,37 +48,114 @@ display = AppDisplay()
 if st.session_state.hcpcs not in st.session_state:
     session_manager.initialize_session_vars()
 
+# Fragments also run inline during a full run; the shared outputs are then drawn once, after both.
+st.session_state['full_run'] = True
+
+# Code-level state only changes with the HCPCS input, which triggers a full rerun.
 if st.session_state['stage'] >= 1:
     session_manager.update_session_state_directs()
     session_manager.update_session_state_current_intensity()
     session_manager.update_session_state_time_bounds()
+    session_manager.update_session_state_peer_position()
+    session_manager.update_session_state_code_flags()
+    session_manager.update_session_state_review_history()
 
-if st.session_state['stage'] > 2:
-    session_manager.update_session_state_filtered_data()
-    session_manager.update_session_state_refinements()
 
-with st.sidebar:
-    form_inputs.display_form()
+def show_review_outputs(slots):
+    """
+    Recomputes the RUC/CMS-dependent results and redraws them in their placeholders.
+    """
+    if st.session_state['stage'] > 2:
+        session_manager.update_session_state_refinements()
+        session_manager.update_session_state_weighted()
+        session_manager.update_session_state_iwput()
+    if st.session_state.tt_lower is not None:
+        with slots['statistics'].container():
+            display.refinement_statistics()
+        with slots['crosswalks'].container():
+            display.potential_crosswalks()
+    with slots['iwput'].container():
+        display.iwput_candidates()
+    if st.session_state.cms_work is not None:
+        with slots['briefing'].container():
+            display.charts_and_text()
+
+
+@st.fragment
+def comparison_view(slots):
+    """
+    Sidebar search widgets; reruns only the comparison set and what is derived from it.
+    """
+    form_inputs.search_form()
+    if st.session_state['stage'] > 2:
+        session_manager.update_session_state_filtered_data()
+    if st.session_state.tt_lower is not None:
+        with slots['comparison'].container():
+            display.filtered_table_results()
+    if not st.session_state['full_run']:
+        show_review_outputs(slots)
+
+
+@st.fragment
+def refinement_view(slots):
+    """
+    RUC/CMS inputs; reruns only the refinement results and the briefing.
+    """
+    if st.session_state.current_work is not None:
+        display.value_input_sections()
+        display.prior_reviews()
+    if not st.session_state['full_run']:
+        show_review_outputs(slots)
 
-tab1, tab2, tab3, tab4 = st.tabs(
-    ["#1. Direct Practice Expense", "#2. Comparison Codes", "#3. Input Refinements", "#4. Briefing Summary"])
+
+@st.fragment
+def family_view():
+    """
+    Code family review; reruns on its own without touching the single-code tabs.
+    """
+    form_inputs.family_codes()
+    session_manager.update_session_state_family()
+    display.family_results()
+
+
+tab1, tab2, tab3, tab4, tab5 = st.tabs(
+    ["#1. Direct Practice Expense", "#2. Comparison Codes", "#3. Input Refinements", "#4. Briefing Summary",
+     "#5. Code Family Review"])
 
 with tab1:
     if st.session_state.hcpcs is not None:
         display.direct_pe_inputs()
+    display.pe_load_timings(pe_load_timings)
 
 with tab2:
-    if st.session_state.tt_lower is not None:
-        display.filtered_table_results()
-        display.potential_crosswalks()
+    if st.session_state.hcpcs is not None:
+        display.peer_context()
+    slots = {'comparison': st.empty(), 'statistics': st.empty(), 'crosswalks': st.empty()}
 
 with tab3:
-    if st.session_state.current_work is not None:
-        display.value_input_sections()
+    inputs_container = st.container()
+    slots['iwput'] = st.empty()
+
+with tab4:
+    slots['briefing'] = st.empty()
+
+with tab5:
+    family_view()
+
+with st.sidebar:
+    form_inputs.display_form()
+    comparison_view(slots)
+
+with inputs_container:
+    refinement_view(slots)
+
+show_review_outputs(slots)
+st.session_state['full_run'] = False
 
 with tab4:
     if st.session_state.cms_work is not None:
-        display.charts_and_text()
+        display.save_review_button(on_click=session_manager.save_review)
+        display.export_buttons(on_prepare=session_manager.prepare_export)
 
 with st.container():
     st.write("Session State:", st.session_state)
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+# Pre Time Package identifies a standard package rather than a number of minutes, so it is not audited.
+AUDITED_COLUMNS = ['pre_eval_time', 'pre_posi_time', 'pre_sdw_time', 'current_ist', 'post_imed_time',
+                   'post_visit_time', 'current_tt', 'current_work', 'hosp_postop_visit_count',
+                   'off_postop_visit_count']
+TT_COMPONENTS = ['pre_eval_time', 'pre_posi_time', 'pre_sdw_time', 'current_ist', 'post_imed_time', 'post_visit_time']
+GLOBAL_VALUES = ['000', '010', '090', 'MMM', 'XXX', 'YYY', 'ZZZ']
+NO_POSTOP_GLOBALS = ['000', 'MMM', 'XXX', 'ZZZ']
+# Rows failing these checks are moved to the quarantine table; other reasons are kept as warnings.
+QUARANTINE_REASONS = ['UNPARSEABLE_FIELD', 'NEGATIVE_VALUE', 'IST_EXCEEDS_TT', 'TT_COMPONENT_MISMATCH']
+TT_TOLERANCE = 1.0
+
+
+def audit_ruc(raw, numeric, tolerance=TT_TOLERANCE):
+    """
+    Checks every RUC row at once. raw holds the values as read and numeric the same columns
+    after pd.to_numeric(errors='coerce'), before missing values are filled. Returns a boolean
+    frame with one column per reason code, aligned with raw.
+    """
+    blank = raw[AUDITED_COLUMNS].isna() | raw[AUDITED_COLUMNS].astype(str).apply(lambda col: col.str.strip() == '')
+    values = numeric[AUDITED_COLUMNS].fillna(0)
+    visits = values['hosp_postop_visit_count'] + values['off_postop_visit_count']
+    global_value = raw['global_value'].astype(str).str.strip().str.upper()
+    # Blank components (common for older time sources) can't be checked against the total, but
+    # the recorded ones still can't add up to more than it.
+    components_missing = blank[TT_COMPONENTS].any(axis=1)
+    component_gap = values[TT_COMPONENTS].sum(axis=1) - values['current_tt']
+    component_gap = component_gap.where(~components_missing, component_gap.clip(lower=0)).abs()
+    return pd.DataFrame({
+        'UNPARSEABLE_FIELD': (numeric[AUDITED_COLUMNS].isna() & ~blank).any(axis=1),
+        'NEGATIVE_VALUE': (values < 0).any(axis=1),
+        'IST_EXCEEDS_TT': values['current_ist'] > values['current_tt'],
+        'TT_COMPONENT_MISMATCH': (values['current_tt'] > 0) & (component_gap > tolerance),
+        'TT_COMPONENTS_MISSING': (values['current_tt'] > 0) & components_missing,
+        'UNKNOWN_GLOBAL': ~global_value.isin(GLOBAL_VALUES),
+        'VISITS_ON_NO_POSTOP_GLOBAL': global_value.isin(NO_POSTOP_GLOBALS) & (visits > 0),
+        'VISIT_TIME_WITHOUT_VISITS': (values['post_visit_time'] > 0) & (visits == 0),
+        'VISITS_WITHOUT_VISIT_TIME': (visits > 0) & (values['post_visit_time'] == 0),
+    }, index=raw.index)
+
+
+def flag_table(hcpcs, checks):
+    """
+    One row per flagged code with its reason codes joined by ';', indexed by hcpcs.
+    """
+    flagged = checks.any(axis=1).to_numpy()
+    reasons = np.where(checks.to_numpy()[flagged], checks.columns.to_numpy(), '')
+    return pd.DataFrame({
+        'reasons': [';'.join(filter(None, row)) for row in reasons],
+        'quarantined': checks[QUARANTINE_REASONS].to_numpy()[flagged].any(axis=1),
+    }, index=pd.Index(hcpcs.to_numpy()[flagged], name='hcpcs'))
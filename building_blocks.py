@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# RVU per minute for the RUC's standard pre- and immediate post-service building blocks.
+PRE_EVAL_INTENSITY = 0.0224
+PRE_POSITIONING_INTENSITY = 0.0224
+PRE_SCRUB_DRESS_WAIT_INTENSITY = 0.0081
+IMMEDIATE_POST_INTENSITY = 0.0224
+# Work RVU per post-operative visit: 99231 (hospital) and 99213 (office) in Addendum B of the
+# CY 2021 PFS final rule, the year of the RUC database. Set the environment variables to review
+# against another year's visit values.
+HOSPITAL_VISIT_WORK = float(os.environ.get('CODE_REVR_HOSPITAL_VISIT_WORK', 0.76))
+OFFICE_VISIT_WORK = float(os.environ.get('CODE_REVR_OFFICE_VISIT_WORK', 1.30))
+
+BLOCK_COLUMNS = ['pre_eval_time', 'pre_posi_time', 'pre_sdw_time', 'current_ist', 'post_imed_time',
+                 'hosp_postop_visit_count', 'off_postop_visit_count']
+
+
+def _array(values):
+    return np.asarray(pd.to_numeric(values, errors='coerce'), dtype=float)
+
+
+def building_blocks(df, work=None, ist=None):
+    """
+    Derives pre-service, post-service and visit work and the resulting intra-service work per
+    unit of time for every row at once. work and ist default to the current values and may be
+    given as scalars or arrays to evaluate proposed values.
+    """
+    work = _array(df['current_work']) if work is None else np.broadcast_to(_array(work), len(df))
+    ist = _array(df['current_ist']) if ist is None else np.broadcast_to(_array(ist), len(df))
+    pre_work = (_array(df['pre_eval_time']) * PRE_EVAL_INTENSITY
+                + _array(df['pre_posi_time']) * PRE_POSITIONING_INTENSITY
+                + _array(df['pre_sdw_time']) * PRE_SCRUB_DRESS_WAIT_INTENSITY)
+    post_work = _array(df['post_imed_time']) * IMMEDIATE_POST_INTENSITY
+    visit_work = (_array(df['hosp_postop_visit_count']) * HOSPITAL_VISIT_WORK
+                  + _array(df['off_postop_visit_count']) * OFFICE_VISIT_WORK)
+    intra_work = work - pre_work - post_work - visit_work
+    with np.errstate(divide='ignore', invalid='ignore'):
+        iwput = np.where(ist > 0, intra_work / ist, np.nan)
+    return pd.DataFrame({
+        'hcpcs': df['hcpcs'].to_numpy(),
+        'global_value': df['global_value'].to_numpy(),
+        'pre_service_work': pre_work,
+        'post_service_work': post_work,
+        'visit_work': visit_work,
+        'intra_service_work': intra_work,
+        'iwput': iwput,
+    }, index=df.index)
+
+
+def _rescaled(work, current_time, proposed_time, intensity):
+    """
+    Work for a proposed time, at the code's current work per minute or, without current time, at intensity.
+    """
+    if proposed_time is None or pd.isna(proposed_time):
+        return work
+    if current_time > 0:
+        return work * proposed_time / current_time
+    return proposed_time * intensity
+
+
+def candidate_iwput(row, work, ist, preservice=None, postservice=None):
+    """
+    IWPUT of a single code at a proposed work RVU and intra-service time. Proposed preservice
+    and postservice times rescale the pre-service work and the immediate post-service plus
+    visit work by their ratio to the minutes behind that work: evaluation, positioning and
+    scrub/dress/wait time, and current_postservice. None keeps the current time.
+    """
+    blocks = building_blocks(row.to_frame().T, work=work, ist=ist).iloc[0]
+    pre_minutes = np.nansum(_array([row['pre_eval_time'], row['pre_posi_time'], row['pre_sdw_time']]))
+    pre_work = _rescaled(blocks['pre_service_work'], pre_minutes, preservice, PRE_EVAL_INTENSITY)
+    post_work = _rescaled(blocks['post_service_work'] + blocks['visit_work'], row['current_postservice'],
+                          postservice, IMMEDIATE_POST_INTENSITY)
+    ist = _array([ist])[0]
+    return (_array([work])[0] - pre_work - post_work) / ist if ist > 0 else np.nan
+
+
+def peer_percentile(iwputs, value):
+    """
+    Mid-rank percentile of value among the peer IWPUTs, ignoring codes without one.
+    """
+    peers = np.sort(iwputs[~np.isnan(iwputs)])
+    if len(peers) == 0 or value is None or np.isnan(value):
+        return None
+    return (np.searchsorted(peers, value, 'left') + np.searchsorted(peers, value, 'right')) / 2 / len(peers) * 100
@@ -0,0 +1,239 @@
+import contextlib
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded least-recently-used cache with hit/miss counters.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data), 'maxsize': self.maxsize}
+
+
+class LRUBackend:
+    """
+    Keeps results in process memory. Cached values are shared, so callers must not mutate them.
+    """
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+
+    def wrap(self, func, max_entries=None):
+        store = LRUCache(max_entries or self.maxsize)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            value = store.get(key, _MISSING)
+            if value is _MISSING:
+                value = func(*args, **kwargs)
+                store.put(key, value)
+            return value
+
+        wrapper.clear = store.clear
+        wrapper.stats = store.stats
+        return wrapper
+
+
+class DiskBackend:
+    """
+    Pickles results under a directory so they survive process restarts.
+    """
+    def __init__(self, directory='./.cache'):
+        self.directory = directory
+
+    def wrap(self, func, max_entries=None):
+        directory = os.path.join(self.directory, f'{func.__module__}.{func.__qualname__}')
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = hashlib.sha256(pickle.dumps((args, sorted(kwargs.items())))).hexdigest()
+            path = os.path.join(directory, f'{key}.pkl')
+            try:
+                with open(path, 'rb') as f:
+                    return pickle.load(f)
+            except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+                pass
+            value = func(*args, **kwargs)
+            os.makedirs(directory, exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(value, f)
+            os.replace(tmp_path, path)
+            return value
+
+        def clear():
+            if os.path.isdir(directory):
+                for name in os.listdir(directory):
+                    os.remove(os.path.join(directory, name))
+
+        wrapper.clear = clear
+        return wrapper
+
+
+class StreamlitBackend:
+    """
+    Delegates to st.cache_data; only usable when Streamlit is installed.
+    """
+    def wrap(self, func, max_entries=None):
+        import streamlit as st
+        return st.cache_data(func, max_entries=max_entries)
+
+
+_backend = LRUBackend()
+_backend_lock = threading.Lock()
+
+
+def set_backend(backend):
+    """
+    Selects the cache used by every @cached function. Call before the first load.
+    """
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def get_backend():
+    return _backend
+
+
+class _Versions(threading.local):
+    pending = None
+
+
+_versions = {}
+_versions_lock = threading.Lock()
+_thread_versions = _Versions()
+_registry = []
+
+
+def file_versions(directory):
+    """
+    (mtime_ns, size) of every file in directory; this is the version a raw data file is known by.
+    """
+    versions = {}
+    if os.path.isdir(directory):
+        for entry in os.scandir(directory):
+            if entry.is_file():
+                stat = entry.stat()
+                versions[entry.name] = (stat.st_mtime_ns, stat.st_size)
+    return versions
+
+
+def dataset_version(name):
+    """
+    Version of a raw data file as seen by the current thread. Files that were never
+    published are at version 0.
+    """
+    pending = _thread_versions.pending
+    if pending is not None and name in pending:
+        return pending[name]
+    return _versions.get(name, 0)
+
+
+@contextlib.contextmanager
+def pending_versions(versions):
+    """
+    Lets the current thread build against unpublished versions before they are swapped in.
+    """
+    previous = _thread_versions.pending
+    _thread_versions.pending = dict(previous or {}, **versions)
+    try:
+        yield
+    finally:
+        _thread_versions.pending = previous
+
+
+def publish_versions(versions):
+    """
+    Atomically makes new file versions visible to every thread.
+    """
+    global _versions
+    with _versions_lock:
+        _versions = dict(_versions, **versions)
+
+
+def dependents(names):
+    """
+    Cached functions that depend on any of the named files, in definition order.
+    """
+    names = set(names)
+    return [func for func in _registry if names & set(func.depends_on)]
+
+
+def cached(func=None, depends_on=(), max_entries=None):
+    """
+    Caches func with whichever backend is selected when it is first called. Results are
+    keyed on the versions of the raw data files named in depends_on, so replacing a file
+    only invalidates the functions that read it. Arguments are bound with their defaults
+    filled in, so f() and f(None) share an entry when None is the default.
+    """
+    if func is None:
+        return functools.partial(cached, depends_on=tuple(depends_on), max_entries=max_entries)
+    state = {'backend': None, 'inner': None}
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def versioned(versions, *args, **kwargs):
+        return func(*args, **kwargs)
+
+    # Keep func's name for backend cache keys but expose the versions argument to signature inspection.
+    del versioned.__wrapped__
+
+    def resolve():
+        with _backend_lock:
+            if state['backend'] is not _backend:
+                state['backend'] = _backend
+                state['inner'] = _backend.wrap(versioned, max_entries=max_entries)
+            return state['inner']
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        versions = tuple(dataset_version(name) for name in depends_on)
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return resolve()(versions, *bound.args, **bound.kwargs)
+
+    def clear():
+        if state['inner'] is not None:
+            state['inner'].clear()
+
+    wrapper.clear = clear
+    wrapper.depends_on = tuple(depends_on)
+    _registry.append(wrapper)
+    return wrapper
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+
+ALL = '*'
+DIMENSIONS = ['top_specialty', 'global_value']
+METRICS = ['current_iwput', 'current_work', 'current_tt']
+QUANTILES = [0.25, 0.5, 0.75]
+
+
+class PeerCube:
+    """
+    Aggregates of the RUC table over top_specialty x global_value, including the roll-ups
+    to each single dimension and to the whole table (marked with ALL). Every cell keeps
+    its sorted metric values, so a percentile rank is a binary search.
+    """
+    def __init__(self, cells):
+        self.cells = cells
+        self.summary = self._summarize(cells)
+
+    @classmethod
+    def from_ruc(cls, df):
+        values = df[DIMENSIONS + METRICS].copy()
+        values[METRICS] = values[METRICS].apply(pd.to_numeric, errors='coerce')
+        values[DIMENSIONS] = values[DIMENSIONS].fillna('Unknown').astype(str)
+        cells = {}
+        for metric in METRICS:
+            ordered = values[DIMENSIONS + [metric]].dropna(subset=[metric]).sort_values(metric, kind='mergesort')
+            ordered['all_specialties'] = ALL
+            ordered['all_globals'] = ALL
+            for specialty_key, global_key in [('top_specialty', 'global_value'), ('top_specialty', 'all_globals'),
+                                              ('all_specialties', 'global_value'),
+                                              ('all_specialties', 'all_globals')]:
+                for key, group in ordered.groupby([specialty_key, global_key], sort=False):
+                    cells.setdefault(key, {})[metric] = group[metric].to_numpy(dtype=float)
+        return cls(cells)
+
+    @staticmethod
+    def _summarize(cells):
+        rows = []
+        for (specialty, global_value), metrics in cells.items():
+            row = {'top_specialty': specialty, 'global_value': global_value}
+            for metric, values in metrics.items():
+                row[f'{metric}_count'] = len(values)
+                row[f'{metric}_mean'] = values.mean()
+                for q, value in zip(QUANTILES, np.quantile(values, QUANTILES)):
+                    row[f'{metric}_q{int(q * 100)}'] = value
+            rows.append(row)
+        return pd.DataFrame(rows).sort_values(DIMENSIONS).reset_index(drop=True)
+
+    def values(self, metric, top_specialty=ALL, global_value=ALL):
+        """
+        Returns the sorted metric values of one cell, or an empty array if the cell is empty.
+        """
+        return self.cells.get((str(top_specialty), str(global_value)), {}).get(metric, np.empty(0))
+
+    def percentile_rank(self, value, metric, top_specialty=ALL, global_value=ALL):
+        """
+        Mid-rank percentile of value within a cell: ties count as half below and half above.
+        """
+        values = self.values(metric, top_specialty, global_value)
+        if len(values) == 0 or value is None or np.isnan(value):
+            return None
+        below = np.searchsorted(values, value, side='left')
+        at_or_below = np.searchsorted(values, value, side='right')
+        return (below + at_or_below) / 2 / len(values) * 100
+
+    def position(self, row):
+        """
+        Locates one RUC row within its specialty x global, specialty and global peer groups.
+        """
+        specialty = 'Unknown' if pd.isna(row['top_specialty']) else str(row['top_specialty'])
+        global_value = 'Unknown' if pd.isna(row['global_value']) else str(row['global_value'])
+        groups = {
+            f'{specialty} / {global_value}': (specialty, global_value),
+            f'{specialty} / all globals': (specialty, ALL),
+            f'all specialties / {global_value}': (ALL, global_value),
+        }
+        records = []
+        for metric in METRICS:
+            value = pd.to_numeric(row[metric], errors='coerce')
+            for label, (specialty_key, global_key) in groups.items():
+                values = self.values(metric, specialty_key, global_key)
+                records.append({
+                    'metric': metric,
+                    'peer_group': label,
+                    'value': value,
+                    'peer_count': len(values),
+                    'peer_median': np.median(values) if len(values) else None,
+                    'percentile_rank': self.percentile_rank(value, metric, specialty_key, global_key),
+                })
+        return pd.DataFrame(records)
@@ -1,7 +1,9 @@
 import streamlit as st
 import pandas as pd
-import plotly.graph_objects as go
-import plotly.express as px
+from lazy_import import LazyModule
+
+go = LazyModule('plotly.graph_objects')
+px = LazyModule('plotly.express')
 
 def display_search_results():
     st.write(f"# Search Results for {st.session_state.hcpcs}")
@@ -0,0 +1,224 @@
+"""
+Streaming export of review packets to Excel or CSV.
+
+Usage: python export.py CODE [CODE ...] --output packets.xlsx [--format xlsx|csv] [--window 25]
+
+Rows are streamed to disk one at a time (openpyxl write-only mode for Excel, one CSV
+file per table otherwise), so memory stays flat however large the comparison sets are.
+In bulk mode every table carries a review_hcpcs column identifying its packet, and each
+code is compared against codes within --window percent of its total and intra-service time.
+Unknown codes are skipped and reported; if the export fails, no partial output is left behind.
+"""
+import argparse
+import csv
+import math
+import os
+import shutil
+import sys
+import zipfile
+
+import numpy as np
+
+from family import DEFAULT_WINDOW
+from funcs import BriefingText, DirectPECalculator, DPEICalculator, RefinementFunctions
+
+SHEETS = ['Summary', 'Supply', 'Equipment', 'Labor', 'Comparison Set', 'Work 25th Percentile', 'Crosswalks',
+          'Briefing']
+TABLES = {
+    'Supply': 'df_current_supply',
+    'Equipment': 'df_current_equipment',
+    'Labor': 'df_current_labor',
+    'Comparison Set': 'df_filtered',
+    'Work 25th Percentile': 'df_work25th',
+    'Crosswalks': 'potential_crosswalks',
+}
+SUMMARY_KEYS = [
+    'search_global_value', 'current_tt', 'current_ist', 'current_work', 'current_preservice', 'current_postservice',
+    'ruc_tt', 'ruc_ist', 'ruc_work', 'cms_tt', 'cms_ist', 'cms_work', 'tt_lower', 'tt_upper', 'ist_lower',
+    'ist_upper', 'current_dpe_tot_f', 'current_dpe_tot_nf', 'tt_ratio', 'tt_ratio_percent', 'tt_ratio_work',
+    'ist_ratio', 'ist_ratio_work', 'filtered_search_count', 'quartile_search_count', 'median_work25th',
+    'count_lower_values',
+]
+
+
+class UnknownCodeError(KeyError):
+    pass
+
+
+def _cell(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def packet_from_values(values):
+    """
+    Collects the tables and text of one review from a mapping such as st.session_state.
+    Returns a list of (sheet, header, rows) with rows as lazy iterators.
+    """
+    hcpcs = values['hcpcs']
+    summary = [(key, values.get(key)) for key in SUMMARY_KEYS]
+    packet = [('Summary', ['field', 'value'], iter(summary))]
+    for sheet, key in TABLES.items():
+        df = values.get(key)
+        if df is not None and len(df.columns):
+            packet.append((sheet, list(df.columns), df.itertuples(index=False, name=None)))
+    packet.append(('Briefing', ['briefing'], iter([(BriefingText.compose(values),)])))
+    return hcpcs, packet
+
+
+def build_values(hcpcs, window=None, **overrides):
+    """
+    Runs a complete review for one code, as RefinementFunctions.review, and adds its direct PE
+    tables and totals.
+    """
+    values = RefinementFunctions.review(hcpcs, window=window, **overrides)
+    if values is None:
+        raise UnknownCodeError(f'Unknown HCPCS code: {hcpcs}')
+    values['df_current_supply'] = DPEICalculator.get_current_supply(hcpcs)
+    values['df_current_equipment'] = DPEICalculator.get_current_equip(hcpcs)
+    values['df_current_labor'] = DPEICalculator.get_current_labor(hcpcs)
+    values['current_dpe_tot_f'], values['current_dpe_tot_nf'] = DirectPECalculator.get_direct_pe(hcpcs)
+    return values
+
+
+class ExcelPacketWriter:
+    """
+    Appends packets to one workbook with a sheet per table, in write-only mode.
+    """
+    def __init__(self, path):
+        from openpyxl import Workbook
+
+        self.path = path
+        self.workbook = Workbook(write_only=True)
+        self.sheets = {name: self.workbook.create_sheet(name) for name in SHEETS}
+        self.started = set()
+
+    def write(self, hcpcs, packet):
+        for sheet, header, rows in packet:
+            worksheet = self.sheets[sheet]
+            if sheet not in self.started:
+                worksheet.append(['review_hcpcs', *header])
+                self.started.add(sheet)
+            for row in rows:
+                worksheet.append([hcpcs, *map(_cell, row)])
+
+    def close(self):
+        self.workbook.save(self.path)
+
+    def abort(self):
+        # Saving finalizes the write-only sheets' temporary files; the partial workbook is then discarded.
+        try:
+            self.workbook.save(self.path)
+        finally:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class CsvPacketWriter:
+    """
+    Appends packets to one CSV file per table and bundles them into a zip archive.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.directory = f'{path}.parts'
+        os.makedirs(self.directory, exist_ok=True)
+        self.files = {}
+
+    def _writer(self, sheet, header):
+        if sheet not in self.files:
+            f = open(os.path.join(self.directory, f'{sheet}.csv'), 'w', newline='', encoding='utf-8')
+            writer = csv.writer(f)
+            writer.writerow(['review_hcpcs', *header])
+            self.files[sheet] = (f, writer)
+        return self.files[sheet][1]
+
+    def write(self, hcpcs, packet):
+        for sheet, header, rows in packet:
+            writer = self._writer(sheet, header)
+            for row in rows:
+                writer.writerow([hcpcs, *map(_cell, row)])
+
+    def close(self):
+        for f, _ in self.files.values():
+            f.close()
+        with zipfile.ZipFile(self.path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for sheet in SHEETS:
+                part = os.path.join(self.directory, f'{sheet}.csv')
+                if os.path.exists(part):
+                    archive.write(part, arcname=f'{sheet}.csv')
+                    os.remove(part)
+        os.rmdir(self.directory)
+
+    def abort(self):
+        for f, _ in self.files.values():
+            f.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+WRITERS = {'xlsx': ExcelPacketWriter, 'csv': CsvPacketWriter}
+
+
+def export_values(values, path, fmt='xlsx'):
+    """
+    Writes the review held in a mapping such as st.session_state.
+    """
+    with WRITERS[fmt](path) as writer:
+        writer.write(*packet_from_values(values))
+    return path
+
+
+def export_reviews(codes, path, fmt='xlsx', window=DEFAULT_WINDOW, **overrides):
+    """
+    Bulk mode: reviews each code in turn and streams its packet before moving to the next.
+    Returns the path and the unknown codes that were skipped.
+    """
+    skipped = []
+    with WRITERS[fmt](path) as writer:
+        for hcpcs in codes:
+            try:
+                values = build_values(hcpcs, window=window, **overrides)
+            except UnknownCodeError:
+                skipped.append(hcpcs)
+                continue
+            writer.write(*packet_from_values(values))
+    return path, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('codes', nargs='+')
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--format', choices=sorted(WRITERS), default='xlsx')
+    parser.add_argument('--window', type=float, default=DEFAULT_WINDOW * 100,
+                        help='comparison window around each code\'s total and intra-service time, in percent')
+    args = parser.parse_args()
+    _, skipped = export_reviews(args.codes, args.output, fmt=args.format, window=args.window / 100)
+    if skipped:
+        print(f"Skipped unknown codes: {', '.join(skipped)}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+DEFAULT_WINDOW = 0.25
+
+
+def review_family(ruc, repricing, codes, window=DEFAULT_WINDOW, cms_work=None, lookup=None):
+    """
+    Reviews related codes together. One union comparison window per global value is scanned
+    once; each code's comparison subset, bottom-quartile statistics and crosswalks are then
+    masks over that shared set. Each code's own window spans its current total and
+    intra-service times +/- window. cms_work maps codes to the CMS work value used for
+    crosswalks and defaults to the current work RVU. Direct PE totals come from the
+    repricing matrix's baseline. The family codes themselves are looked up in lookup
+    (default ruc), so codes held back from comparison sets can still be reviewed. Returns the
+    family table, the shared window's rows and the codes that were not found.
+    """
+    cms_work = cms_work or {}
+    lookup = ruc if lookup is None else lookup
+    targets = lookup[lookup['hcpcs'].isin(codes)].drop_duplicates('hcpcs').set_index('hcpcs')
+    missing = [code for code in dict.fromkeys(codes) if code not in targets.index]
+    targets = targets.reindex([code for code in dict.fromkeys(codes) if code in targets.index])
+    if targets.empty:
+        return pd.DataFrame(), pd.DataFrame(), missing
+    bounds = pd.DataFrame({
+        'tt_lower': targets['current_tt'] * (1 - window), 'tt_upper': targets['current_tt'] * (1 + window),
+        'ist_lower': targets['current_ist'] * (1 - window), 'ist_upper': targets['current_ist'] * (1 + window),
+    })
+    records, union_sets = [], []
+    for global_value, members in targets.groupby('global_value', sort=False):
+        member_bounds = bounds.loc[members.index]
+        union = ruc[(ruc['global_value'] == global_value)
+                    & ruc['current_tt'].between(member_bounds['tt_lower'].min(), member_bounds['tt_upper'].max())
+                    & ruc['current_ist'].between(member_bounds['ist_lower'].min(), member_bounds['ist_upper'].max())]
+        union = union.dropna(subset=['current_work'])
+        union_sets.append(union)
+        tt = union['current_tt'].to_numpy()
+        ist = union['current_ist'].to_numpy()
+        work = union['current_work'].to_numpy()
+        union_codes = union['hcpcs'].to_numpy()
+        for hcpcs, limits in member_bounds.iterrows():
+            mask = ((tt >= limits['tt_lower']) & (tt <= limits['tt_upper'])
+                    & (ist >= limits['ist_lower']) & (ist <= limits['ist_upper']))
+            subset = work[mask]
+            cut = np.percentile(subset, 25) if len(subset) else np.nan
+            bottom = mask & (work <= cut)
+            target_work = cms_work.get(hcpcs, targets.at[hcpcs, 'current_work'])
+            records.append(dict(
+                limits.to_dict(),
+                hcpcs=hcpcs,
+                global_value=global_value,
+                current_work=targets.at[hcpcs, 'current_work'],
+                filtered_search_count=int(mask.sum()),
+                work_25th_percentile=cut,
+                quartile_search_count=int(bottom.sum()),
+                median_work25th=np.median(work[bottom]) if bottom.any() else np.nan,
+                potential_crosswalks=', '.join(union_codes[bottom & (work == target_work)]),
+            ))
+    family = pd.DataFrame(records).set_index('hcpcs')
+    family['family_work_rank'] = family['current_work'].rank(ascending=False, method='min').astype(int)
+    family = family.join(repricing.current(family.index))
+    family = family.sort_values('family_work_rank').reset_index()
+    union = pd.concat(union_sets).drop_duplicates('hcpcs') if union_sets else pd.DataFrame()
+    return family, union, missing
@@ -1,8 +1,17 @@
+import cache
 import pfs_data as pfs
+from building_blocks import building_blocks, candidate_iwput, peer_percentile
+from family import DEFAULT_WINDOW, review_family
+from review_store import get_store
 import pandas as pd
 import numpy as np
 
 
+COMPARISON_CACHE = cache.LRUCache(maxsize=256)
+BOOTSTRAP_CACHE = cache.LRUCache(maxsize=64)
+FAMILY_CACHE = cache.LRUCache(maxsize=64)
+
+
 class DataLoader:
     @staticmethod
     def load_and_filter_df(hcpcs, load_function):
@@ -13,6 +22,20 @@ class DataLoader:
         else:
             return pd.DataFrame()
 
+    @staticmethod
+    def preload_pe_tables(initializer=None):
+        """
+        Warms the supply, equipment and labor caches with one concurrent load.
+        """
+        return pfs.load_pe_tables(initializer=initializer)
+
+    @staticmethod
+    def pe_load_timings():
+        """
+        Seconds spent parsing each PE workbook and loading all of them ('total') on the last load.
+        """
+        return dict(pfs.PE_LOAD_TIMINGS)
+
 
 class DPEICalculator:
     @staticmethod
@@ -58,10 +81,20 @@ class DirectPECalculator:
         return 0, 0
 
 
+class RepricingCalculator:
+    @staticmethod
+    def reprice(supply_prices=None, equip_prices=None, labor_rates=None):
+        """
+        New facility and non-facility direct PE for every code under {item: new price} changes.
+        """
+        return pfs.load_repricing_matrix().reprice(supply_prices=supply_prices, equip_prices=equip_prices,
+                                                   labor_rates=labor_rates)
+
+
 class IntensityCalculator:
     @staticmethod
     def get_current_intensity(hcpcs):
-        df = DataLoader.load_and_filter_df(hcpcs, pfs.load_ruc)
+        df = DataLoader.load_and_filter_df(hcpcs, pfs.load_ruc_codes)
         if not df.empty:
             return tuple(df.iloc[0][col] for col in
                          ['global_value', 'current_tt', 'current_ist', 'current_preservice', 'current_postservice',
@@ -73,8 +106,9 @@ class IntensityCalculator:
         """
         Calculates time bounds based on current intensity values.
         """
-        _, current_tt, current_ist, _, _, _ = IntensityCalculator.get_current_intensity(hcpcs)
-        if current_tt is not None and current_ist is not None:
+        current = IntensityCalculator.get_current_intensity(hcpcs)
+        if current is not None:
+            _, current_tt, current_ist, _, _, _ = current
             tt_min = 0.0
             tt_max = current_tt * 2.0
             ist_min = 0.0
@@ -84,19 +118,206 @@ class IntensityCalculator:
 
     @staticmethod
     def get_filtered_data(search_global_value, tt_lower, tt_upper, ist_lower, ist_upper):
+        """
+        Returns the comparison set and its bottom work quartile. Results are shared through
+        COMPARISON_CACHE across sessions and threads, so callers must not modify them.
+        """
+        key = (cache.dataset_version('raw.csv'), search_global_value, tt_lower, tt_upper, ist_lower, ist_upper)
+        result = COMPARISON_CACHE.get(key)
+        if result is None:
+            result = IntensityCalculator._filter_data(*key[1:])
+            COMPARISON_CACHE.put(key, result)
+        return result
+
+    @staticmethod
+    def _filter_data(search_global_value, tt_lower, tt_upper, ist_lower, ist_upper):
         df = pfs.load_ruc()
         if not df.empty:
             condition = (df['global_value'] == search_global_value) & (df['current_tt'] >= tt_lower) & (
                         df['current_tt'] <= tt_upper) & (df['current_ist'] >= ist_lower) & (
                                     df['current_ist'] <= ist_upper)
             df_filtered = df[condition].dropna(subset=['current_work'])
+            if df_filtered.empty:
+                return df_filtered, df_filtered.iloc[0:0]
             work_25th_percentile = np.percentile(df_filtered['current_work'], 25)
             df_work25th = df_filtered[df_filtered['current_work'] <= work_25th_percentile]
             return df_filtered, df_work25th
         return pd.DataFrame(), pd.DataFrame()
 
 
+class WeightedStatistics:
+    @staticmethod
+    def get_work25th_stats(search_global_value, tt_lower, tt_upper, ist_lower, ist_upper, ruc_work):
+        """
+        Unweighted and utilization-weighted bottom-quartile statistics for a comparison window.
+        """
+        return pfs.load_work_index().work25th_stats(search_global_value, tt_lower, tt_upper, ist_lower, ist_upper,
+                                                    ruc_work)
+
+
+class DataQuality:
+    @staticmethod
+    def get_flags(codes):
+        """
+        Audit reason codes for any of the given codes that were flagged at load time.
+        """
+        flags = pfs.load_ruc_flags()
+        return flags[flags.index.isin(list(codes))].reset_index()
+
+
+class FamilyCalculator:
+    @staticmethod
+    def get_family_review(codes, window=DEFAULT_WINDOW, cms_work=None):
+        """
+        Per-code comparison metrics, crosswalks, direct PE and work RVU rank for a code family,
+        derived from one shared comparison window. Also returns the shared window's rows and the
+        codes that were not found. Results are shared through FAMILY_CACHE, so callers must not
+        modify them.
+        """
+        key = (tuple(cache.dataset_version(name) for name in ['raw.csv', *pfs.PE_WORKBOOKS.values()]),
+               tuple(codes), window, tuple(sorted((cms_work or {}).items())))
+        result = FAMILY_CACHE.get(key)
+        if result is None:
+            result = review_family(pfs.load_ruc(), pfs.load_repricing_matrix(), codes, window=window,
+                                   cms_work=cms_work, lookup=pfs.load_ruc_codes())
+            FAMILY_CACHE.put(key, result)
+        return result
+
+
+class PeerStatistics:
+    @staticmethod
+    def get_peer_position(hcpcs):
+        """
+        Percentile ranks of a code's IWPUT, work RVU and total time within its peer groups.
+        """
+        df = DataLoader.load_and_filter_df(hcpcs, pfs.load_ruc_codes)
+        if not df.empty:
+            return pfs.load_peer_cube().position(df.iloc[0])
+        return pd.DataFrame()
+
+
+class IwputCalculator:
+    @staticmethod
+    def get_candidate_iwputs(hcpcs, candidates, df_filtered):
+        """
+        Recomputes IWPUT for each named (work, ist, preservice, postservice) candidate and ranks
+        it against the comparison set and against every code with the same global value.
+        """
+        df = DataLoader.load_and_filter_df(hcpcs, pfs.load_ruc_codes)
+        if df.empty:
+            return pd.DataFrame()
+        row = df.iloc[0]
+        blocks = pfs.load_building_blocks()
+        # The comparison set may come from an earlier version of raw.csv, so derive its IWPUTs from its own rows.
+        comparison_iwputs = building_blocks(df_filtered)['iwput'].to_numpy() if not df_filtered.empty else np.empty(0)
+        global_iwputs = blocks.loc[blocks['global_value'] == row['global_value'], 'iwput'].to_numpy()
+        records = []
+        for label, (work, ist, preservice, postservice) in candidates.items():
+            iwput = candidate_iwput(row, work=work, ist=ist, preservice=preservice, postservice=postservice)
+            records.append({
+                'values': label,
+                'work': work,
+                'ist': ist,
+                'preservice': preservice,
+                'postservice': postservice,
+                'iwput': iwput,
+                'comparison_percentile': peer_percentile(comparison_iwputs, iwput),
+                'global_percentile': peer_percentile(global_iwputs, iwput),
+            })
+        return pd.DataFrame(records)
+
+
+class ReviewHistory:
+    @staticmethod
+    def save_review(hcpcs, inputs, search_window, metrics, potential_crosswalks):
+        """
+        Queues a finished review for the review store without waiting for the write.
+        """
+        df = DataLoader.load_and_filter_df(hcpcs, pfs.load_ruc_codes)
+        row = df.iloc[0] if not df.empty else pd.Series(dtype=object)
+        crosswalk_codes = [] if potential_crosswalks is None else potential_crosswalks['hcpcs'].tolist()
+        get_store().save(hcpcs=hcpcs, top_specialty=row.get('top_specialty'), global_value=row.get('global_value'),
+                         inputs=inputs, search_window=search_window, metrics=metrics,
+                         crosswalk_codes=crosswalk_codes)
+
+    @staticmethod
+    def flush():
+        """
+        Waits for queued reviews to reach the review store.
+        """
+        get_store().flush()
+
+    @staticmethod
+    def get_history(hcpcs, limit=20):
+        """
+        Prior reviews of the code and of other codes in its specialty.
+        """
+        store = get_store()
+        df = DataLoader.load_and_filter_df(hcpcs, pfs.load_ruc_codes)
+        peers = pd.DataFrame()
+        if not df.empty and pd.notna(df.iloc[0]['top_specialty']):
+            peers = store.peer_history(df.iloc[0]['top_specialty'], exclude_hcpcs=hcpcs, limit=limit)
+        return store.history(hcpcs, limit=limit), peers
+
+
 class RefinementFunctions:
+    @staticmethod
+    def review(hcpcs, window=None, **overrides):
+        """
+        Runs the comparison search and refinements of a complete review for one code, or returns
+        None for an unknown code. The RUC/CMS values default to the code's current values. The
+        search window spans the current total and intra-service times +/- window (a fraction), or
+        only the current times when window is None, as in the app before any slider is moved.
+        overrides replace any of these values.
+        """
+        current = IntensityCalculator.get_current_intensity(hcpcs)
+        if current is None:
+            return None
+        global_value, current_tt, current_ist, current_preservice, current_postservice, current_work = current
+        window = window or 0
+        values = {
+            'hcpcs': hcpcs, 'search_global_value': global_value, 'current_tt': current_tt,
+            'current_ist': current_ist, 'current_work': current_work, 'current_preservice': current_preservice,
+            'current_postservice': current_postservice,
+            'tt_lower': current_tt * (1 - window), 'tt_upper': current_tt * (1 + window),
+            'ist_lower': current_ist * (1 - window), 'ist_upper': current_ist * (1 + window),
+            'ruc_tt': current_tt, 'ruc_ist': current_ist, 'ruc_work': current_work,
+            'cms_tt': current_tt, 'cms_ist': current_ist, 'cms_work': current_work,
+        }
+        values.update(overrides)
+        values['df_filtered'], values['df_work25th'] = IntensityCalculator.get_filtered_data(
+            search_global_value=global_value, tt_lower=float(values['tt_lower']),
+            tt_upper=float(values['tt_upper']), ist_lower=float(values['ist_lower']),
+            ist_upper=float(values['ist_upper']))
+        values.update(RefinementFunctions.summarize(
+            current_tt=current_tt, current_ist=current_ist, current_work=current_work, ruc_tt=values['ruc_tt'],
+            ruc_ist=values['ruc_ist'], ruc_work=values['ruc_work'], cms_work=values['cms_work'],
+            df_filtered=values['df_filtered'], df_work25th=values['df_work25th']))
+        return values
+
+    @staticmethod
+    def summarize(current_tt, current_ist, current_work, ruc_tt, ruc_ist, ruc_work, cms_work, df_filtered,
+                  df_work25th):
+        """
+        Computes every refinement metric for a review, keyed by its session state name.
+        """
+        tt_ratio = RefinementFunctions.get_tt_ratio(ruc_tt=ruc_tt, current_tt=current_tt)
+        ist_ratio = RefinementFunctions.get_ist_ratio(ruc_ist=ruc_ist, current_ist=current_ist)
+        return {
+            'tt_ratio': tt_ratio,
+            'tt_ratio_percent': RefinementFunctions.get_tt_ratio_percent(tt_ratio=tt_ratio),
+            'tt_ratio_work': RefinementFunctions.get_tt_ratio_work(tt_ratio=tt_ratio, current_work=current_work),
+            'ist_ratio': ist_ratio,
+            'ist_ratio_work': RefinementFunctions.get_ist_ratio_work(ist_ratio=ist_ratio, current_work=current_work),
+            'filtered_search_count': RefinementFunctions.filtered_search_count(df_filtered=df_filtered),
+            'quartile_search_count': RefinementFunctions.quartile_search_count(df_work25th=df_work25th),
+            'median_work25th': RefinementFunctions.get_median_work25th(df_work25th=df_work25th),
+            'count_lower_values': RefinementFunctions.count_lower_values(df_work25th=df_work25th, ruc_work=ruc_work),
+            'potential_crosswalks': RefinementFunctions.filter_for_crosswalks(df_work25th=df_work25th,
+                                                                               cms_work=cms_work),
+            'work25th_ci': RefinementFunctions.bootstrap_work25th(df_filtered=df_filtered, ruc_work=ruc_work),
+        }
+
     @staticmethod
     def get_tt_ratio(ruc_tt, current_tt):
         """
@@ -160,9 +381,100 @@ class RefinementFunctions:
        """
         return (df_work25th['current_work'] < ruc_work).sum()
 
+    @staticmethod
+    def _bootstrap_indices(n, n_resamples, seed, max_elements):
+        """
+        Resample index blocks over a comparison set of n codes. A seed always yields the same
+        blocks, split only when every resample at once would exceed max_elements.
+        """
+        rng = np.random.default_rng(seed)
+        block = max(1, min(n_resamples, max_elements // n))
+        for start in range(0, n_resamples, block):
+            yield rng.integers(0, n, size=(min(block, n_resamples - start), n))
+
+    @staticmethod
+    def bootstrap_work25th(df_filtered, ruc_work, n_resamples=2000, confidence=0.95, seed=0,
+                           max_elements=4_000_000):
+        """
+        Bootstrap confidence intervals for the 25th percentile work cut, the median of the bottom
+        quartile and count_lower_values. Resamples index the sorted work values, so a value is
+        below ruc_work exactly when its index is. The cut and median intervals only depend on the
+        comparison set and are kept in BOOTSTRAP_CACHE with each resample's quartile size; a new
+        ruc_work only regenerates the indices and recounts them.
+        """
+        work = np.sort(df_filtered['current_work'].to_numpy(dtype=float))
+        if len(work) == 0:
+            return None
+        tail = (1 - confidence) / 2 * 100
+        bounds = [tail, 100 - tail]
+        key = (work.tobytes(), n_resamples, confidence, seed, max_elements)
+        resampled = BOOTSTRAP_CACHE.get(key)
+        if resampled is None:
+            cuts, medians, quartile_sizes = [], [], []
+            for indices in RefinementFunctions._bootstrap_indices(len(work), n_resamples, seed, max_elements):
+                samples = work[indices]
+                cut = np.percentile(samples, 25, axis=1)
+                in_quartile = samples <= cut[:, None]
+                cuts.append(cut)
+                medians.append(np.nanmedian(np.where(in_quartile, samples, np.nan), axis=1))
+                quartile_sizes.append(in_quartile.sum(axis=1))
+            resampled = {
+                'work_25th_percentile': tuple(np.percentile(np.concatenate(cuts), bounds)),
+                'median_work25th': tuple(np.percentile(np.concatenate(medians), bounds)),
+                'quartile_sizes': np.concatenate(quartile_sizes),
+            }
+            BOOTSTRAP_CACHE.put(key, resampled)
+        # A resample's bottom-quartile values below ruc_work are its values below ruc_work, capped at its quartile size.
+        below = np.searchsorted(work, ruc_work, side='left')
+        lower_counts = np.concatenate([
+            (indices < below).sum(axis=1)
+            for indices in RefinementFunctions._bootstrap_indices(len(work), n_resamples, seed, max_elements)])
+        lower_counts = np.minimum(lower_counts, resampled['quartile_sizes'])
+        return {
+            'confidence': confidence,
+            'n_resamples': n_resamples,
+            'work_25th_percentile': resampled['work_25th_percentile'],
+            'median_work25th': resampled['median_work25th'],
+            'count_lower_values': tuple(np.percentile(lower_counts, bounds)),
+        }
+
     @staticmethod
     def filter_for_crosswalks(df_work25th, cms_work):
         """
        Filters the DataFrame for entries matching the cms_work value.
        """
         return df_work25th[df_work25th['current_work'] == cms_work]
+
+
+class BriefingText:
+    TEMPLATE = ("The code review search is for {hcpcs}. "
+                "The RUC recommended a work RVU of {ruc_work} and Total Time of {ruc_tt}. "
+                "The Total Time search parameters for this review are from {tt_lower} to {tt_upper} minutes. "
+                "The intraservice time search parameters are from {ist_lower} to {ist_upper} minutes. "
+                "The Median Work RVU for the search is {median_work25th}. "
+                "The count of all reference codes in the search is {filtered_search_count}. "
+                "Of these, the count of codes in the bottom quartile, based on work RVU, is {quartile_search_count}. "
+                "The initial search identified {filtered_search_count} codes with a global value of {search_global_value} and with a total time from {tt_lower} to {tt_upper}. "
+                "Of the codes reviewed, {count_lower_values} of the {count_lower_values} codes in the bottom quartile of the reference services found in the RUC dB search have wRVUs lower than the RUC-recommended wRVU of {ruc_work}. "
+                "The total time ratio between the current time of {current_tt} minutes and the recommended time established by the RUC of {ruc_tt} minutes is {tt_ratio}. "
+                "This ratio equals {tt_ratio_percent} percent, and when multiplied by the current wRVU of {current_work} equals {tt_ratio_work}.")
+
+    @staticmethod
+    def compose(values):
+        """
+        Builds the briefing paragraph from a mapping of review values such as st.session_state.
+        """
+        return BriefingText.TEMPLATE.format_map(values) + BriefingText.intervals(values['work25th_ci'])
+
+    @staticmethod
+    def intervals(ci):
+        """
+        Describes the bootstrap confidence intervals, if any were computed.
+        """
+        if ci is None:
+            return ''
+        median_low, median_high = ci['median_work25th']
+        count_low, count_high = ci['count_lower_values']
+        return (f" Across {ci['n_resamples']} bootstrap resamples of the reference codes, the {ci['confidence']:.0%}"
+                f" confidence interval for the median work RVU is {median_low:.2f} to {median_high:.2f}, and for the"
+                f" count of bottom quartile codes below the RUC-recommended wRVU it is {count_low:.0f} to {count_high:.0f}.")
@@ -0,0 +1,53 @@
+"""
+Measures the cold import time of the compute core in a fresh interpreter.
+
+Usage: python importtime.py [module ...]
+Exits non-zero when a module exceeds its budget or pulls in a UI dependency.
+"""
+import subprocess
+import sys
+
+IMPORT_BUDGETS = {
+    'cache': 0.1,
+    'pfs_data': 1.5,
+    'funcs': 1.5,
+}
+UI_MODULES = ['streamlit', 'plotly', 'pyspark']
+
+_PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(elapsed, ','.join(m for m in {ui_modules!r} if m in sys.modules))
+"""
+
+
+def measure_import(module, runs=3):
+    """
+    Returns the best-of-runs import time in seconds and any UI modules the import loaded.
+    """
+    best, ui_loaded = None, []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-c', _PROBE.format(module=module, ui_modules=UI_MODULES)],
+                                capture_output=True, text=True, check=True)
+        elapsed, _, loaded = result.stdout.strip().partition(' ')
+        best = float(elapsed) if best is None else min(best, float(elapsed))
+        ui_loaded = [m for m in loaded.split(',') if m]
+    return best, ui_loaded
+
+
+def main(modules):
+    failed = False
+    for module in modules:
+        elapsed, ui_loaded = measure_import(module)
+        budget = IMPORT_BUDGETS.get(module)
+        over = budget is not None and elapsed > budget
+        failed = failed or over or bool(ui_loaded)
+        print(f"{module:<12} {elapsed * 1000:8.1f} ms  budget {budget * 1000 if budget else float('nan'):8.1f} ms"
+              f"  ui imports: {', '.join(ui_loaded) or 'none'}{'  OVER BUDGET' if over else ''}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:] or list(IMPORT_BUDGETS)))
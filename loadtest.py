@@ -0,0 +1,212 @@
+"""
+Concurrent-session load test for app.py.
+
+Drives the app headlessly with Streamlit's AppTest, running many simulated reviewer
+sessions at once across several processes against synthetic datasets, and reports
+p50/p95/p99 rerun latency per step and peak memory per process.
+
+AppTest.run() always reruns the whole script; it cannot trigger a fragment-scoped rerun.
+The move_sliders, refine and edit steps therefore measure full reruns, an upper bound
+on what a browser session pays when only the fragment holding the widget reruns.
+
+Usage: python loadtest.py [--processes 4] [--sessions 10] [--flows 3] [--codes 5000] [--items 8]
+"""
+import argparse
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+GLOBAL_VALUES = ['000', '010', '090', 'XXX', 'ZZZ']
+SPECIALTIES = ['Cardiology', 'Dermatology', 'General Surgery', 'Orthopaedic Surgery', 'Radiology', 'Urology']
+STEPS = ['enter_hcpcs', 'move_sliders', 'enter_values', 'refine', 'edit_ruc', 'edit_cms']
+VALUE_FIELDS = ['tt', 'ist', 'work', 'preservice', 'postservice']
+
+
+def make_synthetic_data(directory, n_codes=5000, items_per_code=8, seed=0):
+    """
+    Writes raw.csv, supply.xlsx, equip.xlsx and labor.xlsx shaped like the real inputs.
+    Returns the generated HCPCS codes.
+    """
+    rng = np.random.default_rng(seed)
+    codes = [f'{10000 + i:05d}' for i in range(n_codes)]
+    ist = rng.integers(5, 180, n_codes).astype(float)
+    pre_eval, pre_posi, pre_sdw = rng.integers(5, 40, n_codes), rng.integers(0, 15, n_codes), rng.integers(0, 20, n_codes)
+    post_imed = rng.integers(5, 30, n_codes)
+    hosp_visits, off_visits = rng.integers(0, 3, n_codes), rng.integers(0, 4, n_codes)
+    post_visit = (hosp_visits + off_visits) * 20
+    pd.DataFrame({
+        'CPT Code': codes,
+        'Long Desc': [f'Synthetic procedure {code}' for code in codes],
+        'Global': rng.choice(GLOBAL_VALUES, n_codes),
+        'Work RVU': np.round(rng.gamma(2.0, 4.0, n_codes) + 0.1, 2),
+        'Non-Facility Total RVU': np.round(rng.gamma(2.0, 8.0, n_codes), 2),
+        'Facility Total RVU': np.round(rng.gamma(2.0, 6.0, n_codes), 2),
+        'Pre Time Package': rng.integers(0, 5, n_codes),
+        'Pre Eval Time': pre_eval,
+        'Pre Positioning Time': pre_posi,
+        'Pre Scrub, Dress, Wait Time': pre_sdw,
+        'Intra Time': ist,
+        'Immediate Post Time': post_imed,
+        'Post-op Visit Time': post_visit,
+        'Total Time': pre_eval + pre_posi + pre_sdw + ist + post_imed + post_visit,
+        'Hospital Post-op Visit Count': hosp_visits,
+        'Office Post-op Visit Count': off_visits,
+        'Time Source': 'RUC',
+        'Most Recent RUC Review': rng.integers(2000, 2024, n_codes),
+        'Top_Specialty': rng.choice(SPECIALTIES, n_codes),
+        'IWPUT': np.round(rng.uniform(0.01, 0.15, n_codes), 4),
+        'MPC': rng.choice(['Y', 'N'], n_codes),
+        'Vignette': ['A patient presents for a synthetic procedure. ' * 6] * n_codes,
+        '2021 Medicare Utilization': rng.integers(10, 2_000_000, n_codes),
+        '2021 Medicare Allowed Charges': rng.integers(1_000, 100_000_000, n_codes),
+    }).to_csv(os.path.join(directory, 'raw.csv'), index=False)
+
+    rows = n_codes * items_per_code
+    item_codes = rng.integers(0, max(items_per_code * 50, 1), rows)
+    hcpcs = np.repeat(codes, items_per_code)
+    _write_xlsx(os.path.join(directory, 'supply.xlsx'), {
+        'hcpcs': hcpcs, 'cms_code': [f'S{i:05d}' for i in item_codes],
+        'description': [f'Supply {i}' for i in item_codes],
+        'nf_quantity': rng.integers(0, 5, rows), 'f_quantity': rng.integers(0, 3, rows),
+        'price': np.round(10 + item_codes % 97 * 1.5, 2),
+    })
+    _write_xlsx(os.path.join(directory, 'equip.xlsx'), {
+        'hcpcs': hcpcs, 'cms_code': [f'E{i:05d}' for i in item_codes],
+        'description': [f'Equipment {i}' for i in item_codes],
+        'price': np.round(1_000 + item_codes % 89 * 250.0, 2), 'useful_life': 5 + item_codes % 6,
+        'minutes_per_year': 150_000, 'nf_time': rng.integers(0, 60, rows), 'f_time': rng.integers(0, 30, rows),
+    })
+    labor_types = item_codes % 12
+    _write_xlsx(os.path.join(directory, 'labor.xlsx'), {
+        'hcpcs': hcpcs, 'cms_code': [f'L{i:03d}' for i in labor_types],
+        'description': [f'Clinical staff {i}' for i in labor_types],
+        'rate_per_minute': np.round(0.3 + labor_types * 0.05, 2),
+        'nf_time': rng.integers(0, 40, rows), 'f_time': rng.integers(0, 20, rows),
+    })
+    return codes
+
+
+def _write_xlsx(filepath, columns):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(list(columns))
+    values = [np.broadcast_to(np.asarray(column), len(columns['hcpcs'])) for column in columns.values()]
+    for row in zip(*values):
+        sheet.append([value.item() if isinstance(value, np.generic) else value for value in row])
+    workbook.save(filepath)
+
+
+def run_session(app_path, codes, flows, seed, timings):
+    """
+    Replays review flows in one simulated session, appending (step, seconds) to timings.
+    """
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(seed)
+    at = AppTest.from_file(app_path, default_timeout=120)
+    at.run()
+    for _ in range(flows):
+        def timed(step, action):
+            start = time.perf_counter()
+            action().run()
+            timings.append((step, time.perf_counter() - start))
+
+        timed('enter_hcpcs', lambda: at.text_input(key='hcpcs').input(rng.choice(codes)))
+        current_tt, current_ist = at.session_state['current_tt'], at.session_state['current_ist']
+        timed('move_sliders', lambda: at.slider(key='tt_range').set_value(
+            (float(round(current_tt * 0.8)), float(round(current_tt * 1.2)))))
+        at.slider(key='ist_range').set_value((float(round(current_ist * 0.8)), float(round(current_ist * 1.2))))
+
+        def enter_values():
+            # The RUC and CMS inputs start empty; a reviewer fills them before refining.
+            for source in ['ruc', 'cms']:
+                for field in VALUE_FIELDS:
+                    at.number_input(key=f'{source}_{field}').set_value(float(at.session_state[f'current_{field}']))
+            return at
+
+        timed('enter_values', enter_values)
+        timed('refine', lambda: next(button for button in at.button if button.label == 'Refine Time').click())
+        work = at.session_state['current_work']
+        timed('edit_ruc', lambda: at.number_input(key='ruc_work').set_value(round(work * rng.uniform(0.8, 1.1), 2)))
+        timed('edit_cms', lambda: at.number_input(key='cms_work').set_value(round(work * rng.uniform(0.8, 1.0), 2)))
+        if at.exception:
+            raise RuntimeError(f'App raised: {at.exception}')
+
+
+def run_process(app_path, data_dir, review_db, codes, sessions, flows, seed):
+    """
+    Runs concurrent sessions in threads within one process. Returns timings, errors and peak RSS.
+    """
+    os.environ['CODE_REVR_RAW_DATA'] = data_dir
+    # The app runs from its own directory; keep its review store out of the working tree.
+    os.environ['CODE_REVR_REVIEW_DB'] = review_db
+    os.chdir(os.path.dirname(app_path))
+    sys.path.insert(0, os.path.dirname(app_path))
+    timings, errors = [], []
+
+    def session(index):
+        try:
+            run_session(app_path, codes, flows, seed * 1000 + index, timings)
+        except Exception as e:
+            errors.append(repr(e))
+
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {'pid': os.getpid(), 'timings': timings, 'errors': errors, 'peak_rss_mb': peak_rss_mb}
+
+
+def report(results, elapsed):
+    timings = pd.DataFrame([t for result in results for t in result['timings']], columns=['step', 'seconds'])
+    print(f"{len(timings)} reruns in {elapsed:.1f}s")
+    print("Every step is a full script rerun; fragment-scoped reruns (sliders, RUC/CMS inputs) are not simulated.")
+    if not timings.empty:
+        summary = timings.groupby('step')['seconds'].quantile([0.5, 0.95, 0.99]).unstack() * 1000
+        summary.loc['all'] = timings['seconds'].quantile([0.5, 0.95, 0.99]).to_numpy() * 1000
+        summary.columns = ['p50_ms', 'p95_ms', 'p99_ms']
+        print(summary.reindex([step for step in STEPS + ['all'] if step in summary.index]).round(1).to_string())
+    for result in results:
+        print(f"process {result['pid']}: peak RSS {result['peak_rss_mb']:.0f} MB, {len(result['errors'])} failed sessions")
+        for error in result['errors'][:3]:
+            print(f"  {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--sessions', type=int, default=10, help='concurrent sessions per process')
+    parser.add_argument('--flows', type=int, default=3, help='review flows replayed per session')
+    parser.add_argument('--codes', type=int, default=5000, help='rows in the synthetic RUC table')
+    parser.add_argument('--items', type=int, default=8, help='supply, equipment and labor rows per code')
+    parser.add_argument('--data-dir', help='write synthetic data here instead of a temporary directory')
+    args = parser.parse_args()
+    app_path = os.path.abspath(os.path.join(os.path.dirname(__file__), 'app.py'))
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or tmp
+        os.makedirs(data_dir, exist_ok=True)
+        codes = make_synthetic_data(data_dir, n_codes=args.codes, items_per_code=args.items)
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=args.processes, mp_context=get_context('spawn')) as executor:
+            futures = [executor.submit(run_process, app_path, data_dir, os.path.join(tmp, 'reviews.sqlite3'), codes,
+                                       args.sessions, args.flows, seed)
+                       for seed in range(args.processes)]
+            results = [future.result() for future in futures]
+        report(results, time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main()
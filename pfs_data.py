@@ -1,8 +1,189 @@
+import contextlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+
 import pandas as pd
-import streamlit as st
+from audit import QUARANTINE_REASONS, audit_ruc, flag_table
+from building_blocks import building_blocks
+from cache import cached, file_versions, publish_versions
+from cube import PeerCube
+from repricing import ITEM_COLUMNS, RepricingMatrix
+from work_index import WorkIndex
+
+logger = logging.getLogger(__name__)
+
+RAW_DATA_DIR = os.environ.get('CODE_REVR_RAW_DATA', './raw_data')
+PE_WORKBOOKS = {
+    'supply': 'supply.xlsx',
+    'equip': 'equip.xlsx',
+    'labor': 'labor.xlsx',
+}
+# Columns read by the direct PE, repricing and display code; every other column is skipped while parsing.
+PE_COLUMNS = {
+    'supply': ['hcpcs', *ITEM_COLUMNS, 'nf_quantity', 'f_quantity', 'price'],
+    'equip': ['hcpcs', *ITEM_COLUMNS, 'price', 'useful_life', 'minutes_per_year', 'nf_time', 'f_time'],
+    'labor': ['hcpcs', *ITEM_COLUMNS, 'rate_per_minute'],
+}
+PE_LOAD_TIMINGS = {}
+# Results kept per cached loader: the published data version plus one being rebuilt.
+DATASET_ENTRIES = 2
+_parse_pool = None
+_parse_pool_users = 0
+_parse_pool_lock = threading.Lock()
+
+# Key cached results on the files as they are now, so a persistent cache never serves data
+# from files that were replaced while the process was down.
+publish_versions(file_versions(RAW_DATA_DIR))
+
+
+def raw_data_path(filename):
+    return os.path.join(RAW_DATA_DIR, filename)
+
+
+def _named_column(name):
+    """
+    Keeps every column with a header; blank trailing columns are never materialized.
+    """
+    return name is not None and str(name).strip() != ''
+
+
+def _labor_column(name):
+    """
+    Labor minutes are spread over every column prefixed nf or f, so those are kept by prefix.
+    """
+    return name in PE_COLUMNS['labor'] or str(name).startswith(('nf', 'f'))
+
+
+PE_USECOLS = {'supply': PE_COLUMNS['supply'], 'equip': PE_COLUMNS['equip'], 'labor': _labor_column}
+
+
+def read_excel_streaming(filepath, usecols=_named_column):
+    """
+    Parses the first sheet of a workbook with openpyxl's read-only streaming reader,
+    keeping only the columns accepted by usecols (a callable or a list of header names).
+    Returns the DataFrame and the parse time in seconds.
+    """
+    from openpyxl import load_workbook
+
+    start = time.perf_counter()
+    workbook = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, ())
+        accept = usecols if callable(usecols) else set(usecols).__contains__
+        keep = [i for i, name in enumerate(header) if accept(name)]
+        data = [[row[i] if i < len(row) else None for i in keep]
+                for row in rows if any(cell is not None for cell in row)]
+    finally:
+        workbook.close()
+    df = pd.DataFrame(data, columns=[header[i] for i in keep])
+    df = df.infer_objects()
+    return df, time.perf_counter() - start
+
+
+@contextlib.contextmanager
+def _parse_pool_scope(create=True):
+    """
+    Yields the shared spawn parse pool, creating it if asked, or None when there is none.
+    The pool is shut down as soon as its last user leaves, so no worker outlives a load.
+    """
+    global _parse_pool, _parse_pool_users
+    with _parse_pool_lock:
+        if _parse_pool is None and create:
+            _parse_pool = ProcessPoolExecutor(max_workers=len(PE_WORKBOOKS), mp_context=get_context('spawn'))
+        pool = _parse_pool
+        if pool is not None:
+            _parse_pool_users += 1
+    try:
+        yield pool
+    finally:
+        if pool is not None:
+            with _parse_pool_lock:
+                _parse_pool_users -= 1
+                idle = _parse_pool_users == 0
+                if idle:
+                    _parse_pool = None
+            if idle:
+                pool.shutdown()
+
+
+def _load_pe_workbook(name):
+    """
+    Parses one PE workbook in the parse pool while load_pe_tables holds it open, otherwise in-process.
+    """
+    filepath = raw_data_path(PE_WORKBOOKS[name])
+    with _parse_pool_scope(create=False) as pool:
+        if pool is not None:
+            try:
+                df, elapsed = pool.submit(read_excel_streaming, filepath, PE_USECOLS[name]).result()
+            except BrokenProcessPool:
+                # Spawned workers re-import __main__; scripts without a __main__ guard break the pool.
+                logger.warning("Parse pool unavailable, parsing %s in-process", filepath)
+                pool = None
+        if pool is None:
+            df, elapsed = read_excel_streaming(filepath, PE_USECOLS[name])
+    PE_LOAD_TIMINGS[name] = elapsed
+    logger.info("Parsed %s in %.3fs (%d rows)", filepath, elapsed, len(df))
+    return df
+
+
+def load_pe_tables(initializer=None):
+    """
+    Loads the supply, equipment and labor workbooks concurrently, so a cold load is bounded
+    by the slowest file. The parse pool lives only for the duration of the call and is skipped
+    on a single CPU, where the files are parsed in-process. PE_LOAD_TIMINGS keeps the parse
+    time of each file and the wall-clock time of the whole call under 'total'. initializer
+    runs in each loader thread before it starts.
+    """
+    loaders = {'supply': load_supply, 'equip': load_equip, 'labor': load_labor}
+    start = time.perf_counter()
+    with _parse_pool_scope(create=(os.cpu_count() or 1) > 1), \
+            ThreadPoolExecutor(max_workers=len(loaders), initializer=initializer) as executor:
+        futures = {name: executor.submit(loader) for name, loader in loaders.items()}
+        tables = {name: future.result() for name, future in futures.items()}
+    PE_LOAD_TIMINGS['total'] = time.perf_counter() - start
+    logger.info("Loaded PE tables in %.3fs", PE_LOAD_TIMINGS['total'])
+    return tables
 
-@st.cache_data
-def load_ruc(filepath='./raw_data/raw.csv'):
+
+def load_ruc(filepath=None):
+    """
+    RUC rows that passed the load-time audit; comparison sets and peer statistics use these.
+    """
+    return load_ruc_audited(filepath)[0]
+
+
+@cached(depends_on=['raw.csv'], max_entries=DATASET_ENTRIES)
+def load_ruc_codes(filepath=None):
+    """
+    Every valued RUC row, quarantined or not, for looking up a single code's own values.
+    """
+    clean, quarantine, _ = load_ruc_audited(filepath)
+    return pd.concat([clean, quarantine.drop(columns='reasons')]).sort_index()
+
+
+def load_ruc_quarantine(filepath=None):
+    """
+    RUC rows held back by the audit, with their reason codes.
+    """
+    return load_ruc_audited(filepath)[1]
+
+
+def load_ruc_flags(filepath=None):
+    """
+    Reason codes and quarantine status for every flagged code, indexed by hcpcs.
+    """
+    return load_ruc_audited(filepath)[2]
+
+
+@cached(depends_on=['raw.csv'], max_entries=DATASET_ENTRIES)
+def load_ruc_audited(filepath=None):
+    filepath = filepath or raw_data_path('raw.csv')
     df = pd.read_csv(filepath)
     column_mapping = {
         'CPT Code': 'hcpcs',
@@ -36,32 +217,33 @@ def load_ruc(filepath='./raw_data/raw.csv'):
     columns_to_clean = ['pre_time_pckg', 'pre_posi_time', 'pre_eval_time', 'pre_sdw_time',
                         'post_imed_time', 'post_visit_time', 'current_work', 'current_tt',
                         'current_ist', 'hosp_postop_visit_count', 'off_postop_visit_count']
-    df[columns_to_clean] = df[columns_to_clean].apply(pd.to_numeric, errors='coerce').fillna(0)
+    numeric = df[columns_to_clean].apply(pd.to_numeric, errors='coerce')
+    checks = audit_ruc(df, numeric)
+    df[columns_to_clean] = numeric.fillna(0)
     df['current_preservice'] = df[['pre_time_pckg', 'pre_eval_time', 'pre_posi_time']].sum(axis=1).fillna(0)
     df['current_postservice'] = df[['post_imed_time', 'post_visit_time']].sum(axis=1).fillna(0)
-    df = df[df['current_work'] > 0]
-    return df
+    valued = (df['current_work'] > 0).to_numpy()
+    df, checks = df[valued], checks[valued]
+    flags = flag_table(df['hcpcs'], checks)
+    quarantined = checks[QUARANTINE_REASONS].any(axis=1).to_numpy()
+    quarantine = df[quarantined].assign(reasons=flags.loc[flags['quarantined'], 'reasons'].to_numpy())
+    return df[~quarantined], quarantine, flags
 
-@st.cache_data
+@cached(depends_on=['supply.xlsx'], max_entries=DATASET_ENTRIES)
 def load_supply():
-    filepath = './raw_data/supply.xlsx'  # Updated for Excel file
-    df = pd.read_excel(filepath)
-    return df
+    return _load_pe_workbook('supply')
 
-@st.cache_data
+@cached(depends_on=['equip.xlsx'], max_entries=DATASET_ENTRIES)
 def load_equip():
-    filepath = './raw_data/equip.xlsx'
-    df = pd.read_excel(filepath)
-    return df
+    return _load_pe_workbook('equip')
 
-@st.cache_data
+@cached(depends_on=['labor.xlsx'], max_entries=DATASET_ENTRIES)
 def load_labor():
-    filepath = './raw_data/labor.xlsx'
-    df = pd.read_excel(filepath)
-    return df
+    return _load_pe_workbook('labor')
 
-@st.cache_data
-def load_rvu(filepath='./raw_data/rvu.csv'):
+@cached(depends_on=['rvu.csv'], max_entries=DATASET_ENTRIES)
+def load_rvu(filepath=None):
+    filepath = filepath or raw_data_path('rvu.csv')
     df = pd.read_csv(filepath, skiprows=12)
     new_column_names = [
         'hcpcs', 'mod', 'description', 'status_code', 'not_used_for_medicare_payment',
@@ -76,3 +258,23 @@ def load_rvu(filepath='./raw_data/rvu.csv'):
     for column in columns_to_convert:
         df[column] = df[column].astype(str)
     return df
+
+
+@cached(depends_on=['raw.csv'], max_entries=DATASET_ENTRIES)
+def load_peer_cube():
+    return PeerCube.from_ruc(load_ruc())
+
+
+@cached(depends_on=['raw.csv'], max_entries=DATASET_ENTRIES)
+def load_building_blocks():
+    return building_blocks(load_ruc())
+
+
+@cached(depends_on=['supply.xlsx', 'equip.xlsx', 'labor.xlsx'], max_entries=DATASET_ENTRIES)
+def load_repricing_matrix():
+    return RepricingMatrix.from_tables(load_supply(), load_equip(), load_labor())
+
+
+@cached(depends_on=['raw.csv'], max_entries=DATASET_ENTRIES)
+def load_work_index():
+    return WorkIndex.from_ruc(load_ruc())
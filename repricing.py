@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Columns tried, in order, to identify a supply item, equipment item or labor type.
+ITEM_COLUMNS = ('cms_code', 'item_code', 'description')
+
+
+def _item_column(df):
+    for column in ITEM_COLUMNS:
+        if column in df.columns:
+            return column
+    raise KeyError(f'No item identifier column found; expected one of {ITEM_COLUMNS}')
+
+
+def _numeric(values):
+    return pd.to_numeric(values, errors='coerce').fillna(0).to_numpy(dtype=float)
+
+
+class InputMatrix:
+    """
+    Codes x items sparse matrices for one direct PE input table, with one base price per item
+    and which codes appear in the table at all.
+    """
+    def __init__(self, items, nf, f, prices, present):
+        self.items = items
+        self.nf = nf
+        self.f = f
+        self.prices = prices
+        self.present = present
+
+    @classmethod
+    def build(cls, codes, df, nf_values, f_values, prices):
+        rows = codes.get_indexer(df['hcpcs'].astype(str))
+        cols, items = pd.factorize(df[_item_column(df)].astype(str))
+        shape = (len(codes), len(items))
+        nf = sparse.csr_matrix((nf_values, (rows, cols)), shape=shape)
+        f = sparse.csr_matrix((f_values, (rows, cols)), shape=shape)
+        base_prices = pd.Series(prices).groupby(cols).first().reindex(range(len(items))).fillna(0).to_numpy()
+        present = np.zeros(len(codes), dtype=bool)
+        present[rows] = True
+        return cls(pd.Index(items), nf, f, base_prices, present)
+
+    def price_vector(self, price_changes=None):
+        """
+        Base prices with the given {item: new price} overrides applied.
+        """
+        prices = self.prices.copy()
+        if price_changes:
+            positions = self.items.get_indexer(list(map(str, price_changes)))
+            if (positions < 0).any():
+                unknown = [item for item, pos in zip(price_changes, positions) if pos < 0]
+                raise KeyError(f'Unknown items: {unknown}')
+            prices[positions] = list(price_changes.values())
+        return prices
+
+
+class RepricingMatrix:
+    """
+    Direct PE for every code as sparse matrix-vector products over supply quantities,
+    equipment minutes scaled by useful life, and labor minutes. As in
+    DirectPECalculator.get_direct_pe, a code missing from any of the three tables has none.
+    """
+    def __init__(self, codes, supply, equip, labor):
+        self.codes = codes
+        self.inputs = {'supply': supply, 'equip': equip, 'labor': labor}
+        self.complete = supply.present & equip.present & labor.present
+        self.baseline = self.reprice_totals()
+
+    @classmethod
+    def from_tables(cls, supply, equip, labor):
+        codes = pd.Index(sorted(set(supply['hcpcs'].astype(str)) | set(equip['hcpcs'].astype(str))
+                                | set(labor['hcpcs'].astype(str))))
+        supply_matrix = InputMatrix.build(codes, supply, _numeric(supply['nf_quantity']),
+                                          _numeric(supply['f_quantity']), _numeric(supply['price']))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scale = 1 / (_numeric(equip['useful_life']) * _numeric(equip['minutes_per_year']))
+        scale[~np.isfinite(scale)] = 0
+        equip_matrix = InputMatrix.build(codes, equip, _numeric(equip['nf_time']) * scale,
+                                         _numeric(equip['f_time']) * scale, _numeric(equip['price']))
+        nf_columns = [col for col in labor.columns if col.startswith('nf')]
+        f_columns = [col for col in labor.columns if col.startswith('f')]
+        labor_matrix = InputMatrix.build(codes, labor, labor[nf_columns].apply(pd.to_numeric, errors='coerce')
+                                         .fillna(0).sum(axis=1).to_numpy(),
+                                         labor[f_columns].apply(pd.to_numeric, errors='coerce')
+                                         .fillna(0).sum(axis=1).to_numpy(),
+                                         _numeric(labor['rate_per_minute']))
+        return cls(codes, supply_matrix, equip_matrix, labor_matrix)
+
+    def reprice_totals(self, supply_prices=None, equip_prices=None, labor_rates=None):
+        """
+        Returns (facility, non-facility) direct PE arrays aligned with self.codes.
+        """
+        changes = {'supply': supply_prices, 'equip': equip_prices, 'labor': labor_rates}
+        f_total = np.zeros(len(self.codes))
+        nf_total = np.zeros(len(self.codes))
+        for name, matrix in self.inputs.items():
+            prices = matrix.price_vector(changes[name])
+            f_total += matrix.f @ prices
+            nf_total += matrix.nf @ prices
+        return np.where(self.complete, f_total, 0), np.where(self.complete, nf_total, 0)
+
+    def current(self, codes):
+        """
+        Current facility and non-facility direct PE for the given codes, 0 for codes without PE inputs.
+        """
+        current_f, current_nf = self.baseline
+        return pd.DataFrame({'current_dpe_tot_f': current_f, 'current_dpe_tot_nf': current_nf},
+                            index=self.codes.rename('hcpcs')).reindex(list(codes)).fillna(0)
+
+    def reprice(self, supply_prices=None, equip_prices=None, labor_rates=None):
+        """
+        New facility and non-facility direct PE for every code under the given
+        {item: new price} changes, alongside the current totals.
+        """
+        f_total, nf_total = self.reprice_totals(supply_prices, equip_prices, labor_rates)
+        current_f, current_nf = self.baseline
+        return pd.DataFrame({
+            'current_dpe_tot_f': current_f,
+            'current_dpe_tot_nf': current_nf,
+            'new_dpe_tot_f': f_total,
+            'new_dpe_tot_nf': nf_total,
+            'change_f': f_total - current_f,
+            'change_nf': nf_total - current_nf,
+        }, index=self.codes.rename('hcpcs'))
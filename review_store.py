@@ -0,0 +1,164 @@
+import atexit
+import contextlib
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+REVIEW_DB = os.environ.get('CODE_REVR_REVIEW_DB', './reviews.sqlite3')
+JSON_COLUMNS = ['inputs', 'search_window', 'metrics', 'crosswalk_codes']
+# Queue markers: _FLUSH ends the writer's current batch early, _CLOSE also stops the writer.
+_FLUSH = object()
+_CLOSE = object()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reviews (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    hcpcs TEXT NOT NULL,
+    reviewed_at TEXT NOT NULL,
+    top_specialty TEXT,
+    global_value TEXT,
+    inputs TEXT NOT NULL,
+    search_window TEXT NOT NULL,
+    metrics TEXT NOT NULL,
+    crosswalk_codes TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_reviews_hcpcs ON reviews (hcpcs, reviewed_at);
+CREATE INDEX IF NOT EXISTS idx_reviews_reviewed_at ON reviews (reviewed_at);
+CREATE INDEX IF NOT EXISTS idx_reviews_specialty ON reviews (top_specialty, reviewed_at);
+"""
+
+
+def _json_default(value):
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+class ReviewStore:
+    """
+    SQLite store of finished reviews. Saves are queued and written in batches by a
+    background thread, so saving never blocks a rerun; reads go straight to the indexes.
+    Queued reviews are written out when the interpreter exits.
+    """
+    def __init__(self, path=REVIEW_DB, batch_size=100, flush_interval=0.5):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._closed = False
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+        self._writer = threading.Thread(target=self._write_batches, name='review-store-writer', daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def save(self, hcpcs, top_specialty, global_value, inputs, search_window, metrics, crosswalk_codes):
+        """
+        Queues one finished review for writing and returns immediately.
+        """
+        self._queue.put((
+            hcpcs, datetime.now(timezone.utc).isoformat(timespec='seconds'), top_specialty, global_value,
+            json.dumps(inputs, default=_json_default), json.dumps(search_window, default=_json_default),
+            json.dumps(metrics, default=_json_default), json.dumps(list(crosswalk_codes), default=_json_default),
+        ))
+
+    def flush(self):
+        """
+        Blocks until every queued review has been written, without waiting out the batch interval.
+        """
+        if not self._closed:
+            self._queue.put(_FLUSH)
+            self._queue.join()
+
+    def close(self):
+        """
+        Writes every queued review and stops the writer; later saves are not written.
+        """
+        if not self._closed:
+            self._closed = True
+            self._queue.put(_CLOSE)
+            self._writer.join()
+
+    def _write_batches(self):
+        conn = self._connect()
+        closing = False
+        while not closing:
+            batch, markers = [], 0
+            item = self._queue.get()
+            while True:
+                if item is _FLUSH or item is _CLOSE:
+                    markers += 1
+                    closing = item is _CLOSE
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    break
+            try:
+                if batch:
+                    with conn:
+                        conn.executemany('INSERT INTO reviews (hcpcs, reviewed_at, top_specialty, global_value, '
+                                         'inputs, search_window, metrics, crosswalk_codes) '
+                                         'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', batch)
+            except sqlite3.Error:
+                logger.exception("Failed to write %d reviews", len(batch))
+            finally:
+                for _ in range(len(batch) + markers):
+                    self._queue.task_done()
+        conn.close()
+
+    def _query(self, where, params, limit):
+        with contextlib.closing(self._connect()) as conn:
+            df = pd.read_sql_query(f'SELECT * FROM reviews WHERE {where} ORDER BY reviewed_at DESC LIMIT ?', conn,
+                                   params=[*params, limit])
+        for column in JSON_COLUMNS:
+            df[column] = df[column].map(json.loads)
+        return df
+
+    def history(self, hcpcs, limit=20):
+        """
+        Most recent reviews of one code.
+        """
+        return self._query('hcpcs = ?', [hcpcs], limit)
+
+    def peer_history(self, top_specialty, exclude_hcpcs=None, limit=20):
+        """
+        Most recent reviews of other codes in the same specialty.
+        """
+        return self._query('top_specialty = ? AND hcpcs != ?', [top_specialty, exclude_hcpcs or ''], limit)
+
+    def since(self, reviewed_after, limit=100):
+        """
+        Reviews saved after an ISO date or timestamp.
+        """
+        return self._query('reviewed_at >= ?', [reviewed_after], limit)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """
+    The process-wide review store, opened on first use.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ReviewStore()
+        return _store
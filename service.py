@@ -0,0 +1,303 @@
+"""
+Local JSON query service for the code review computations.
+
+Usage: python service.py [--host 127.0.0.1] [--port 8765] [--workers 8] [--queue-size 64]
+
+GET  /intensity?hcpcs=...
+GET  /direct-pe?hcpcs=...
+GET  /comparison?global_value=...&tt_lower=...&tt_upper=...&ist_lower=...&ist_upper=...
+POST /refinements            {"hcpcs": ..., "ruc_work": ..., ...}
+POST /batch/intensity        {"hcpcs": [...]}
+POST /batch/direct-pe        {"hcpcs": [...]}
+POST /batch/refinements      {"requests": [{...}, ...]}
+POST /reprice                {"supply_prices": {item: price}, "equip_prices": {...}, "labor_rates": {...}}
+GET  /metrics
+"""
+import argparse
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+import pfs_data as pfs
+from funcs import COMPARISON_CACHE, DataLoader, DPEICalculator, DirectPECalculator, IntensityCalculator, \
+    RefinementFunctions, RepricingCalculator
+from watcher import RawDataWatcher
+
+logger = logging.getLogger(__name__)
+
+INTENSITY_FIELDS = ['global_value', 'current_tt', 'current_ist', 'current_preservice', 'current_postservice',
+                    'current_work']
+REFINEMENT_PARAMS = ['tt_lower', 'tt_upper', 'ist_lower', 'ist_upper', 'ruc_tt', 'ruc_ist', 'ruc_work', 'cms_work']
+
+
+class NotFound(Exception):
+    pass
+
+
+def to_jsonable(value):
+    """
+    Converts pandas and NumPy results into plain JSON types.
+    """
+    if isinstance(value, pd.DataFrame):
+        return json.loads(value.to_json(orient='records'))
+    if isinstance(value, dict):
+        return {key: to_jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(item) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+def get_intensity(hcpcs):
+    current = IntensityCalculator.get_current_intensity(hcpcs)
+    if current is None:
+        raise NotFound(f'Unknown HCPCS code: {hcpcs}')
+    return dict(zip(INTENSITY_FIELDS, current), hcpcs=hcpcs)
+
+
+def get_direct_pe(hcpcs):
+    current_dpe_tot_f, current_dpe_tot_nf = DirectPECalculator.get_direct_pe(hcpcs)
+    return {
+        'hcpcs': hcpcs,
+        'current_dpe_tot_f': current_dpe_tot_f,
+        'current_dpe_tot_nf': current_dpe_tot_nf,
+        'supply': DPEICalculator.get_current_supply(hcpcs),
+        'equipment': DPEICalculator.get_current_equip(hcpcs),
+        'labor': DPEICalculator.get_current_labor(hcpcs),
+    }
+
+
+def get_comparison(global_value, tt_lower, tt_upper, ist_lower, ist_upper):
+    df_filtered, df_work25th = IntensityCalculator.get_filtered_data(
+        search_global_value=global_value, tt_lower=float(tt_lower), tt_upper=float(tt_upper),
+        ist_lower=float(ist_lower), ist_upper=float(ist_upper))
+    return {'df_filtered': df_filtered, 'df_work25th': df_work25th}
+
+
+def get_refinements(params):
+    """
+    Runs a full review for one code. RUC/CMS values and the search window default to the
+    code's current values, matching the app's initial slider and input positions. The
+    response echoes the values used alongside the refinement metrics.
+    """
+    overrides = {key: params[key] for key in REFINEMENT_PARAMS if key in params}
+    values = RefinementFunctions.review(params['hcpcs'], **overrides)
+    if values is None:
+        raise NotFound(f"Unknown HCPCS code: {params['hcpcs']}")
+    return {key: value for key, value in values.items() if key not in ('df_filtered', 'df_work25th')}
+
+
+def get_repricing(params):
+    df = RepricingCalculator.reprice(supply_prices=params.get('supply_prices'),
+                                     equip_prices=params.get('equip_prices'), labor_rates=params.get('labor_rates'))
+    return df.reset_index()
+
+
+def _batch(func, items):
+    """
+    Runs func on each item, reporting failures per item so one bad item doesn't fail the batch.
+    """
+    results = []
+    for item in items:
+        try:
+            results.append({'ok': True, 'result': func(item)})
+        except NotFound as e:
+            results.append({'ok': False, 'error': str(e)})
+        except (KeyError, TypeError, ValueError) as e:
+            results.append({'ok': False, 'error': f'Bad request: {e!r}'})
+        except Exception as e:
+            logger.exception("Batch item %r failed", item)
+            results.append({'ok': False, 'error': str(e)})
+    return results
+
+
+class ServiceMetrics:
+    """
+    Request counts, errors and a rolling window of latencies per endpoint.
+    """
+    def __init__(self, window=2048):
+        self.started = time.monotonic()
+        self.window = window
+        self.rejected = 0
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, elapsed, ok):
+        with self._lock:
+            stats = self._endpoints.setdefault(endpoint, {'count': 0, 'errors': 0,
+                                                          'latencies': deque(maxlen=self.window)})
+            stats['count'] += 1
+            stats['errors'] += 0 if ok else 1
+            stats['latencies'].append(elapsed)
+
+    def record_rejected(self):
+        with self._lock:
+            self.rejected += 1
+
+    def snapshot(self, queue_depth=None):
+        with self._lock:
+            uptime = time.monotonic() - self.started
+            endpoints = {}
+            for endpoint, stats in self._endpoints.items():
+                latencies = np.array(stats['latencies']) * 1000
+                p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (None, None, None)
+                endpoints[endpoint] = {
+                    'count': stats['count'],
+                    'errors': stats['errors'],
+                    'throughput_per_s': stats['count'] / uptime,
+                    'latency_ms': {'p50': p50, 'p95': p95, 'p99': p99},
+                }
+            return {'uptime_s': uptime, 'rejected': self.rejected, 'queue_depth': queue_depth,
+                    'endpoints': endpoints}
+
+
+class ReviewRequestHandler(BaseHTTPRequestHandler):
+    GET_ROUTES = {
+        '/intensity': lambda q: get_intensity(q['hcpcs']),
+        '/direct-pe': lambda q: get_direct_pe(q['hcpcs']),
+        '/comparison': lambda q: get_comparison(q['global_value'], q['tt_lower'], q['tt_upper'],
+                                                q['ist_lower'], q['ist_upper']),
+    }
+    POST_ROUTES = {
+        '/refinements': get_refinements,
+        '/batch/intensity': lambda body: _batch(get_intensity, body['hcpcs']),
+        '/batch/direct-pe': lambda body: _batch(get_direct_pe, body['hcpcs']),
+        '/batch/refinements': lambda body: _batch(get_refinements, body['requests']),
+        '/reprice': get_repricing,
+    }
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/metrics':
+            metrics = self.server.metrics.snapshot(queue_depth=self.server.requests.qsize())
+            metrics['comparison_cache'] = COMPARISON_CACHE.stats()
+            metrics['pe_load_timings'] = DataLoader.pe_load_timings()
+            self._send(200, metrics)
+            return
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        self._dispatch(url.path, self.GET_ROUTES, query)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError as e:
+            self._send(400, {'error': f'Invalid JSON body: {e}'})
+            return
+        self._dispatch(url.path, self.POST_ROUTES, body)
+
+    def _dispatch(self, path, routes, params):
+        route = routes.get(path)
+        if route is None:
+            self._send(404, {'error': f'Unknown endpoint: {path}'})
+            return
+        start = time.perf_counter()
+        status = 200
+        try:
+            payload = route(params)
+        except NotFound as e:
+            status, payload = 404, {'error': str(e)}
+        except (KeyError, TypeError, ValueError) as e:
+            status, payload = 400, {'error': f'Bad request: {e!r}'}
+        except Exception as e:
+            logger.exception("Request to %s failed", path)
+            status, payload = 500, {'error': str(e)}
+        self.server.metrics.record(path, time.perf_counter() - start, ok=status == 200)
+        self._send(status, payload)
+
+    def _send(self, status, payload):
+        body = json.dumps(to_jsonable(payload)).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class PooledHTTPServer(HTTPServer):
+    """
+    Serves requests from a fixed pool of worker threads fed by a bounded queue.
+    Connections arriving while the queue is full are answered with 503.
+    """
+    def __init__(self, server_address, handler_class, workers=8, queue_size=64):
+        super().__init__(server_address, handler_class)
+        self.metrics = ServiceMetrics()
+        self.requests = queue.Queue(maxsize=queue_size)
+        self.workers = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def process_request(self, request, client_address):
+        try:
+            self.requests.put_nowait((request, client_address))
+        except queue.Full:
+            self.metrics.record_rejected()
+            try:
+                request.sendall(b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            finally:
+                self.shutdown_request(request)
+
+    def _work(self):
+        while True:
+            request, client_address = self.requests.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                self.requests.task_done()
+
+
+def load_datasets():
+    """
+    Loads every dataset once so the first requests don't pay the parse cost.
+    """
+    start = time.perf_counter()
+    pfs.load_ruc()
+    pfs.load_peer_cube()
+    pfs.load_building_blocks()
+    pfs.load_work_index()
+    DataLoader.preload_pe_tables()
+    pfs.load_repricing_matrix()
+    logger.info("Datasets loaded in %.2fs", time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--queue-size', type=int, default=64)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    load_datasets()
+    RawDataWatcher().start()
+    server = PooledHTTPServer((args.host, args.port), ReviewRequestHandler, workers=args.workers,
+                              queue_size=args.queue_size)
+    logger.info("Serving on http://%s:%d", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,26 @@
+import os
+import tempfile
 import streamlit as st
+import numpy as np
 import pandas as pd
-import plotly.graph_objects as go
-import plotly.express as px
-from funcs import DPEICalculator, DirectPECalculator, IntensityCalculator, RefinementFunctions
+from lazy_import import LazyModule
+from export import export_values
+from funcs import DataQuality, DPEICalculator, DirectPECalculator, FamilyCalculator, IntensityCalculator, \
+    IwputCalculator, PeerStatistics, RefinementFunctions, ReviewHistory, BriefingText, WeightedStatistics
+
+go = LazyModule('plotly.graph_objects')
+px = LazyModule('plotly.express')
 
 dpei = DPEICalculator()
 directs = DirectPECalculator()
 intents = IntensityCalculator()
+peers = PeerStatistics()
+iwputs = IwputCalculator()
+history = ReviewHistory()
 refine = RefinementFunctions()
+weighted = WeightedStatistics()
+quality = DataQuality()
+families = FamilyCalculator()
 
 
 class SessionManager:
@@ -22,7 +35,9 @@ class SessionManager:
             'df_current_equipment', 'current_dpe_tot_f', 'current_dpe_tot_nf', 'potential_crosswalks',
             'tt_ratio', 'tt_ratio_percent', 'tt_ratio_work', 'ist_ratio', 'ist_ratio_work',
             'filtered_search_count', 'quartile_search_count', 'median_work25th',
-            'count_lower_values', 'stage'
+            'count_lower_values', 'work25th_ci', 'weighted_work25th', 'peer_position', 'iwput_candidates',
+            'review_history', 'peer_review_history', 'export_path', 'code_flags',
+            'comparison_flags', 'family_review', 'family_union', 'family_missing', 'stage'
         ]
         self.initialize_session_vars()
 
@@ -51,6 +66,11 @@ class SessionManager:
     def update_session_state_current_intensity(self):
             hcpcs = st.session_state['hcpcs']
             current = intents.get_current_intensity(hcpcs=hcpcs)
+            if current is None:
+                flags = quality.get_flags([hcpcs])
+                reasons = f" Data quality flags: {'; '.join(flags['reasons'])}." if not flags.empty else ''
+                st.warning(f"HCPCS code {hcpcs} was not found in the RUC database.{reasons}")
+                current = (None,) * 6
             st.session_state['search_global_value'] = current[0]
             st.session_state['current_tt'] = current[1]
             st.session_state['current_ist'] = current[2]
@@ -58,6 +78,24 @@ class SessionManager:
             st.session_state['current_postservice'] = current[4]
             st.session_state['current_work'] = current[5]
 
+    def update_session_state_peer_position(self):
+            hcpcs = st.session_state['hcpcs']
+            st.session_state['peer_position'] = peers.get_peer_position(hcpcs=hcpcs)
+
+    def update_session_state_code_flags(self):
+            st.session_state['code_flags'] = quality.get_flags([st.session_state['hcpcs']])
+
+    def update_session_state_family(self):
+            codes = [code.strip() for code in (st.session_state['family_codes'] or '').split(',') if code.strip()]
+            if codes:
+                family_review, family_union, family_missing = families.get_family_review(
+                    codes=codes, window=st.session_state['family_window'] / 100)
+            else:
+                family_review, family_union, family_missing = None, None, []
+            st.session_state['family_review'] = family_review
+            st.session_state['family_union'] = family_union
+            st.session_state['family_missing'] = family_missing
+
     def update_session_state_time_bounds(self):
             hcpcs = st.session_state['hcpcs']
             time_bounds = intents.get_time_bounds(hcpcs=hcpcs)
@@ -76,6 +114,7 @@ class SessionManager:
             filtered_data = intents.get_filtered_data(search_global_value=search_global_value, tt_lower=tt_lower, tt_upper=tt_upper, ist_lower=ist_lower, ist_upper=ist_upper)
             st.session_state['df_filtered'] = filtered_data[0]
             st.session_state['df_work25th'] = filtered_data[1]
+            st.session_state['comparison_flags'] = quality.get_flags(filtered_data[0]['hcpcs'])
     def update_session_state_refinements(self):
             current_tt = st.session_state['current_tt']
             current_ist = st.session_state['current_ist']
@@ -86,26 +125,58 @@ class SessionManager:
             cms_work = st.session_state['cms_work']
             df_filtered = st.session_state['df_filtered']
             df_work25th = st.session_state['df_work25th']
-            tt_ratio = refine.get_tt_ratio(ruc_tt=ruc_tt, current_tt=current_tt)
-            tt_ratio_percent = refine.get_tt_ratio_percent(tt_ratio=tt_ratio)
-            tt_ratio_work = refine.get_tt_ratio_work(tt_ratio=tt_ratio, current_work=current_work)
-            ist_ratio = refine.get_ist_ratio(ruc_ist=ruc_ist, current_ist=current_ist)
-            ist_ratio_work = refine.get_ist_ratio_work(ist_ratio=ist_ratio, current_work=current_work)
-            filtered_search_count = refine.filtered_search_count(df_filtered=df_filtered)
-            quartile_search_count = refine.quartile_search_count(df_work25th=df_work25th)
-            median_work25th = refine.get_median_work25th(df_work25th=df_work25th)
-            count_lower_values = refine.count_lower_values(df_work25th=df_work25th, ruc_work=ruc_work)
-            potential_crosswalks = refine.filter_for_crosswalks(df_work25th=df_work25th, cms_work=cms_work)
-            st.session_state['tt_ratio'] = tt_ratio
-            st.session_state['tt_ratio_percent'] = tt_ratio_percent
-            st.session_state['tt_ratio_work'] = tt_ratio_work
-            st.session_state['ist_ratio'] = ist_ratio
-            st.session_state['ist_ratio_work'] = ist_ratio_work
-            st.session_state['filtered_search_count'] = filtered_search_count
-            st.session_state['quartile_search_count'] = quartile_search_count
-            st.session_state['median_work25th'] = median_work25th
-            st.session_state['count_lower_values'] = count_lower_values
-            st.session_state['potential_crosswalks'] = potential_crosswalks
+            refinements = refine.summarize(current_tt=current_tt, current_ist=current_ist, current_work=current_work,
+                                           ruc_tt=ruc_tt, ruc_ist=ruc_ist, ruc_work=ruc_work, cms_work=cms_work,
+                                           df_filtered=df_filtered, df_work25th=df_work25th)
+            for key, value in refinements.items():
+                st.session_state[key] = value
+
+    def update_session_state_weighted(self):
+            st.session_state['weighted_work25th'] = weighted.get_work25th_stats(
+                search_global_value=st.session_state['search_global_value'],
+                tt_lower=st.session_state['tt_lower'], tt_upper=st.session_state['tt_upper'],
+                ist_lower=st.session_state['ist_lower'], ist_upper=st.session_state['ist_upper'],
+                ruc_work=st.session_state['ruc_work'])
+
+    def update_session_state_iwput(self):
+            # The current candidate keeps the code's own pre- and post-service times.
+            candidates = {'Current': (st.session_state['current_work'], st.session_state['current_ist'], None, None)}
+            candidates.update({
+                label: tuple(st.session_state[f'{prefix}_{value}'] for value in ['work', 'ist', 'preservice', 'postservice'])
+                for label, prefix in [('RUC', 'ruc'), ('CMS', 'cms')]
+            })
+            st.session_state['iwput_candidates'] = iwputs.get_candidate_iwputs(
+                hcpcs=st.session_state['hcpcs'], candidates=candidates, df_filtered=st.session_state['df_filtered'])
+
+    def update_session_state_review_history(self):
+            review_history, peer_review_history = history.get_history(hcpcs=st.session_state['hcpcs'])
+            st.session_state['review_history'] = review_history
+            st.session_state['peer_review_history'] = peer_review_history
+
+    def save_review(self):
+            inputs = {key: st.session_state[key] for key in [
+                'ruc_tt', 'ruc_ist', 'ruc_work', 'ruc_preservice', 'ruc_postservice',
+                'cms_tt', 'cms_ist', 'cms_work', 'cms_preservice', 'cms_postservice']}
+            search_window = {key: st.session_state[key] for key in ['tt_lower', 'tt_upper', 'ist_lower', 'ist_upper']}
+            metrics = {key: st.session_state[key] for key in [
+                'current_tt', 'current_ist', 'current_work', 'current_dpe_tot_f', 'current_dpe_tot_nf',
+                'tt_ratio', 'tt_ratio_percent', 'tt_ratio_work', 'ist_ratio', 'ist_ratio_work',
+                'filtered_search_count', 'quartile_search_count', 'median_work25th', 'count_lower_values']}
+            history.save_review(hcpcs=st.session_state['hcpcs'], inputs=inputs, search_window=search_window,
+                                metrics=metrics, potential_crosswalks=st.session_state['potential_crosswalks'])
+            # The save has to land before the history is re-read, or it won't show under Prior Reviews.
+            history.flush()
+            self.update_session_state_review_history()
+
+    def prepare_export(self, fmt):
+            if st.session_state['export_path'] is not None and os.path.exists(st.session_state['export_path']):
+                os.remove(st.session_state['export_path'])
+            suffix = '.xlsx' if fmt == 'xlsx' else '.zip'
+            fd, path = tempfile.mkstemp(prefix=f"review_{st.session_state['hcpcs']}_", suffix=suffix)
+            os.close(fd)
+            st.session_state['export_path'] = export_values(st.session_state, path, fmt=fmt)
+
+
 class FormInputs:
     def set_state(self, i):
         st.session_state.stage = i
@@ -113,7 +184,9 @@ class FormInputs:
     def display_form(self):
         if st.session_state.stage >= 0:
             self.initial_hcpcs()
-        if st.session_state.stage >= 1:
+
+    def search_form(self):
+        if st.session_state.stage >= 1 and st.session_state.current_tt is not None:
             self.ist_range()
             self.tt_range()
             self.refine_search()
@@ -154,6 +227,14 @@ class FormInputs:
         st.session_state.tt_lower = st.session_state.tt_range[0]
         st.session_state.tt_upper = st.session_state.tt_range[1]
 
+    def family_codes(self):
+        st.text_input(label='Enter related HCPCS codes, separated by commas', key='family_codes')
+        st.slider(
+            label="Comparison window around each code's total and intraservice time (%):",
+            min_value=0, max_value=100, value=25, step=5,
+            key='family_window'
+        )
+
     def refine_search(self):
         refine_time = st.button(
             label="Refine Time",
@@ -207,12 +288,54 @@ class AppDisplay:
         st.write(f"Total direct PE for facility setting: {st.session_state.current_dpe_tot_f} ")
         st.write(f"Total direct PE for non-facility setting: {st.session_state.current_dpe_tot_nf}")
 
+    @staticmethod
+    def pe_load_timings(timings):
+        if timings:
+            files = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in timings.items() if name != 'total')
+            st.caption(f"PE tables loaded in {timings.get('total', 0):.2f}s ({files})")
+
     @staticmethod
     def filtered_table_results():
         st.subheader("Filtered Search Results")
         st.dataframe(st.session_state.df_filtered)
         st.subheader("Work 25th Percentile Options")
         st.dataframe(st.session_state.df_work25th)
+        if st.session_state.comparison_flags is not None and not st.session_state.comparison_flags.empty:
+            st.subheader("Data Quality Flags in the Comparison Set")
+            st.dataframe(st.session_state.comparison_flags)
+
+    @staticmethod
+    def refinement_statistics():
+        AppDisplay.bootstrap_intervals()
+        AppDisplay.weighted_statistics()
+
+    @staticmethod
+    def weighted_statistics():
+        if st.session_state.weighted_work25th is not None and not st.session_state.weighted_work25th.empty:
+            st.subheader("Unweighted and Utilization-Weighted Statistics")
+            st.dataframe(st.session_state.weighted_work25th)
+
+    @staticmethod
+    def peer_context():
+        if st.session_state.peer_position is not None and not st.session_state.peer_position.empty:
+            st.subheader(f"Peer Context for {st.session_state.hcpcs}")
+            st.dataframe(st.session_state.peer_position)
+        if st.session_state.code_flags is not None and not st.session_state.code_flags.empty:
+            st.warning(f"Data quality flags for {st.session_state.hcpcs}: "
+                       f"{'; '.join(st.session_state.code_flags['reasons'])}")
+
+    @staticmethod
+    def bootstrap_intervals():
+        ci = st.session_state.work25th_ci
+        if ci is not None:
+            st.subheader(f"{ci['confidence']:.0%} Bootstrap Confidence Intervals ({ci['n_resamples']} resamples)")
+            st.dataframe(pd.DataFrame({
+                'statistic': ['Work 25th percentile', 'Median work RVU (bottom quartile)', 'Count lower than RUC work'],
+                'estimate': [np.percentile(st.session_state.df_filtered['current_work'], 25), st.session_state.median_work25th,
+                             st.session_state.count_lower_values],
+                'lower': [ci['work_25th_percentile'][0], ci['median_work25th'][0], ci['count_lower_values'][0]],
+                'upper': [ci['work_25th_percentile'][1], ci['median_work25th'][1], ci['count_lower_values'][1]],
+            }))
 
     def value_input_sections(self):
         if st.session_state.current_work is not None:
@@ -221,6 +344,12 @@ class AppDisplay:
             self.ruc_values(col2)
             self.cms_values(col3)
 
+    @staticmethod
+    def iwput_candidates():
+        if st.session_state.iwput_candidates is not None and not st.session_state.iwput_candidates.empty:
+            st.subheader("Proposed IWPUT Against Peer Codes")
+            st.dataframe(st.session_state.iwput_candidates)
+
     def current_values(self, column):
         with column:
             st.subheader(f"Current Values for {st.session_state.hcpcs}")
@@ -236,6 +365,45 @@ class AppDisplay:
             st.subheader(f"CMS Values for {st.session_state.hcpcs}")
             FormInputs.cms_values(self)
 
+    @staticmethod
+    def prior_reviews():
+        with st.expander("Prior Reviews"):
+            st.write(f"Earlier reviews of {st.session_state.hcpcs}")
+            st.dataframe(st.session_state.review_history)
+            st.write("Recent reviews of codes in the same specialty")
+            st.dataframe(st.session_state.peer_review_history)
+
+    @staticmethod
+    def save_review_button(on_click):
+        st.button(label="Save Review", on_click=on_click)
+
+    @staticmethod
+    def export_buttons(on_prepare):
+        col1, col2 = st.columns(2)
+        with col1:
+            st.button(label="Prepare Excel Packet", on_click=on_prepare, args=['xlsx'])
+        with col2:
+            st.button(label="Prepare CSV Packet", on_click=on_prepare, args=['csv'])
+        path = st.session_state.export_path
+        if path is not None and os.path.exists(path):
+            with open(path, 'rb') as f:
+                st.download_button(label=f"Download {os.path.basename(path)}", data=f,
+                                   file_name=f"review_packet_{st.session_state.hcpcs}{os.path.splitext(path)[1]}")
+
+    @staticmethod
+    def family_results():
+        df = st.session_state.family_review
+        if st.session_state.family_missing and df is not None and not df.empty:
+            st.warning(f"Not found in the RUC database: {', '.join(st.session_state.family_missing)}")
+        if df is not None and not df.empty:
+            st.subheader("Family Review, in Work RVU Rank Order")
+            st.dataframe(df)
+            st.subheader(f"Shared Comparison Window ({len(st.session_state.family_union)} codes)")
+            st.dataframe(st.session_state.family_union)
+        elif df is not None:
+            st.write(f"None of the entered codes were found in the RUC database: "
+                     f"{', '.join(st.session_state.family_missing)}")
+
     @staticmethod
     def potential_crosswalks():
         with st.container():
@@ -317,5 +485,4 @@ class AppDisplay:
             st.plotly_chart(fig_bar)
 
     def briefing_text(self):
-        st.write(
-            f"The code review search is for {st.session_state.hcpcs}. The RUC recommended a work RVU of {st.session_state.ruc_work} and Total Time of {st.session_state.ruc_tt}. The Total Time search parameters for this review are from {st.session_state.tt_lower} to {st.session_state.tt_upper} minutes. The intraservice time search parameters are from {st.session_state.ist_lower} to {st.session_state.ist_upper} minutes. The Median Work RVU for the search is {st.session_state.median_work25th}. The count of all reference codes in the search is {st.session_state.filtered_search_count}. Of these, the count of codes in the bottom quartile, based on work RVU, is {st.session_state.quartile_search_count}. The initial search identified {st.session_state.filtered_search_count} codes with a global value of {st.session_state.search_global_value} and with a total time from {st.session_state.tt_lower} to {st.session_state.tt_upper}. Of the codes reviewed, {st.session_state.count_lower_values} of the {st.session_state.count_lower_values} codes in the bottom quartile of the reference services found in the RUC dB search have wRVUs lower than the RUC-recommended wRVU of {st.session_state.ruc_work}. The total time ratio between the current time of {st.session_state.current_tt} minutes and the recommended time established by the RUC of {st.session_state.ruc_tt} minutes is {st.session_state.tt_ratio}. This ratio equals {st.session_state.tt_ratio_percent} percent, and when multiplied by the current wRVU of {st.session_state.current_work} equals {st.session_state.tt_ratio_work}.")
+        st.write(BriefingText.compose(st.session_state))
@@ -1,10 +1,14 @@
 import numpy as np
 import pandas as pd
-from pyspark.sql import DataFrame as PySparkDataFrame
-from pyspark.sql import functions as F
+from lazy_import import LazyModule
+
+F = LazyModule('pyspark.sql.functions')
 
 # Helper function to determine if a DataFrame is PySpark or Pandas
 def is_pyspark_df(df):
+    if not type(df).__module__.startswith('pyspark'):
+        return False
+    from pyspark.sql import DataFrame as PySparkDataFrame
     return isinstance(df, PySparkDataFrame)
 
 # Helper function to validate a given code ID.
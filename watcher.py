@@ -0,0 +1,83 @@
+import logging
+import threading
+import time
+
+import cache
+import pfs_data as pfs
+
+logger = logging.getLogger(__name__)
+
+
+class RawDataWatcher:
+    """
+    Polls the raw data directory and, when a file is replaced, rebuilds only the cached
+    datasets that depend on it in the background before swapping the new version in.
+    A file must look the same on two consecutive polls before it is reloaded, so
+    half-copied files are not picked up.
+    """
+    def __init__(self, directory=None, interval=2.0):
+        self.directory = directory or pfs.RAW_DATA_DIR
+        self.interval = interval
+        self.reloads = []
+        self._snapshot = cache.file_versions(self.directory)
+        self._pending = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='raw-data-watcher', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Raw data poll failed")
+
+    def poll(self):
+        """
+        Reloads every file whose stat has changed and then held steady for one poll.
+        """
+        current = cache.file_versions(self.directory)
+        ready = {}
+        for name, stat in current.items():
+            if stat == self._snapshot.get(name):
+                self._pending.pop(name, None)
+            elif self._pending.get(name) == stat:
+                ready[name] = stat
+            else:
+                self._pending[name] = stat
+        if ready:
+            self.reload(ready)
+
+    def reload(self, files):
+        """
+        Rebuilds the dependents of the changed files against their new versions, then publishes
+        the versions in one step. If a rebuild fails the old data stays live and the files are
+        retried on their next change.
+        """
+        versions = dict(files)
+        loaders = cache.dependents(versions)
+        start = time.perf_counter()
+        try:
+            with cache.pending_versions(versions):
+                for loader in loaders:
+                    loader()
+        except Exception:
+            logger.exception("Reloading %s failed; keeping the current data", ', '.join(sorted(files)))
+        else:
+            cache.publish_versions(versions)
+            elapsed = time.perf_counter() - start
+            self.reloads.append({'files': sorted(files), 'loaders': [loader.__name__ for loader in loaders],
+                                 'seconds': elapsed})
+            logger.info("Reloaded %s (%s) in %.2fs", ', '.join(sorted(files)),
+                        ', '.join(loader.__name__ for loader in loaders), elapsed)
+        for name, stat in files.items():
+            self._pending.pop(name, None)
+            self._snapshot[name] = stat
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+WEIGHT_COLUMN = 'medicare21util'
+
+
+def _weighted_quantile(work, cum_weights, q):
+    """
+    Smallest work value whose cumulative weight reaches q of the total; work must be sorted.
+    """
+    if len(work) == 0 or cum_weights[-1] <= 0:
+        return np.nan
+    return work[np.searchsorted(cum_weights, q * cum_weights[-1], side='left')]
+
+
+class WorkIndex:
+    """
+    RUC rows per global_value sorted by work RVU, with utilization weights precomputed. A
+    comparison window is a mask over an already sorted group, so nothing is re-sorted per
+    window: its cumulative weights take one pass over the window, and the weighted statistics
+    are then binary searches over them, like the unweighted ones. A window covering the whole
+    group reuses the group's precomputed running totals.
+    """
+    def __init__(self, groups):
+        self.groups = groups
+
+    @classmethod
+    def from_ruc(cls, df):
+        ordered = df.assign(weight=pd.to_numeric(df[WEIGHT_COLUMN], errors='coerce').fillna(0).clip(lower=0))
+        ordered = ordered.dropna(subset=['current_work']).sort_values('current_work', kind='mergesort')
+        groups = {}
+        for global_value, group in ordered.groupby('global_value', sort=False):
+            weight = group['weight'].to_numpy(dtype=float)
+            groups[str(global_value)] = {
+                'work': group['current_work'].to_numpy(dtype=float),
+                'weight': weight,
+                'cum_weight': np.cumsum(weight),
+                'tt': group['current_tt'].to_numpy(dtype=float),
+                'ist': group['current_ist'].to_numpy(dtype=float),
+            }
+        return cls(groups)
+
+    def window(self, global_value, tt_lower, tt_upper, ist_lower, ist_upper):
+        """
+        Sorted work values and cumulative weights of the codes inside a comparison window.
+        """
+        group = self.groups.get(str(global_value))
+        if group is None:
+            return np.empty(0), np.empty(0)
+        mask = ((group['tt'] >= tt_lower) & (group['tt'] <= tt_upper)
+                & (group['ist'] >= ist_lower) & (group['ist'] <= ist_upper))
+        if mask.all():
+            return group['work'], group['cum_weight']
+        return group['work'][mask], np.cumsum(group['weight'][mask])
+
+    def work25th_stats(self, global_value, tt_lower, tt_upper, ist_lower, ist_upper, ruc_work):
+        """
+        25th percentile cut, bottom-quartile median and values below ruc_work, unweighted and
+        weighted by utilization. The weighted lower value is the share of bottom-quartile
+        utilization billed under codes with a work RVU below ruc_work.
+        """
+        work, cum_weights = self.window(global_value, tt_lower, tt_upper, ist_lower, ist_upper)
+        if len(work) == 0:
+            return pd.DataFrame()
+        cut = np.percentile(work, 25)
+        n_bottom = np.searchsorted(work, cut, side='right')
+        n_lower = np.searchsorted(work[:n_bottom], ruc_work, side='left')
+
+        if cum_weights[-1] > 0:
+            weighted_cut = _weighted_quantile(work, cum_weights, 0.25)
+            w_bottom = np.searchsorted(work, weighted_cut, side='right')
+            w_lower = np.searchsorted(work[:w_bottom], ruc_work, side='left')
+            bottom_weight = cum_weights[w_bottom - 1]
+            lower_weight = cum_weights[w_lower - 1] if w_lower else 0.0
+            weighted = [weighted_cut, _weighted_quantile(work[:w_bottom], cum_weights[:w_bottom], 0.5),
+                        w_bottom, lower_weight / bottom_weight if bottom_weight > 0 else np.nan]
+        else:
+            # Without any utilization in the window there is no weighted quartile.
+            weighted = [np.nan] * 4
+        return pd.DataFrame({
+            'statistic': ['Work 25th percentile', 'Median work RVU (bottom quartile)', 'Codes in bottom quartile',
+                          'Lower than RUC work (count / utilization share)'],
+            'unweighted': [cut, np.median(work[:n_bottom]), n_bottom, n_lower],
+            'utilization_weighted': weighted,
+        })